@@ -0,0 +1,64 @@
+from restfx import route
+from restfx.http import HttpFile, HttpRequest
+
+
+@route('基准测试', '查询')
+def get(a: int, b: str = 'x', items: list = None):
+    """
+    带查询参数的 GET 请求
+    :param a:
+    :param b:
+    :param items:
+    :return:
+    """
+    return {
+        'a': a,
+        'b': b,
+        'items': items,
+        'rows': [{'i': i, 'name': 'row-%d' % i} for i in range(10)]
+    }
+
+
+@route('基准测试', '提交 JSON')
+def post(user_name: str, tags: list = None, score: float = 0):
+    """
+    提交 JSON 数据
+    :param user_name:
+    :param tags:
+    :param score:
+    :return:
+    """
+    return {
+        'user_name': user_name,
+        'tags': tags,
+        'score': score
+    }
+
+
+@route('基准测试', '上传文件')
+def post_upload(name: str, file: HttpFile):
+    """
+    上传文件 (multipart/form-data)
+    :param name:
+    :param file:
+    :return:
+    """
+    return {
+        'name': name,
+        'filename': file.filename,
+        'size': len(file.stream.read())
+    }
+
+
+@route('基准测试', '使用 session')
+def get_session(request: HttpRequest):
+    """
+    读写 session 数据
+    :param request:
+    :return:
+    """
+    count = request.session.get('count', 0) + 1
+    request.session.set('count', count)
+    return {
+        'count': count
+    }
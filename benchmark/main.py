@@ -0,0 +1,298 @@
+"""
+请求处理流程的基准测试
+
+直接使用构造的 wsgi environ 调用 App.__call__，不经过网络，用于发现路由分发、参数绑定、中间件等环节的性能变化。
+
+用法:
+    python benchmark/main.py                          # 运行所有场景
+    python benchmark/main.py -s get_query json_post   # 运行指定的场景
+    python benchmark/main.py --save baseline.json     # 保存结果作为基准
+    python benchmark/main.py --compare baseline.json  # 与基准对比，吞吐量下降超过阈值时返回非 0 退出码
+"""
+import argparse
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(root, '../src'))
+
+from restfx import App
+from restfx.middleware.access import AccessMiddleware
+from restfx.middleware.middlewares import OptionsMiddleware, SessionMiddleware, TimetickMiddleware
+from restfx.session.providers import MemorySessionProvider
+
+
+class Scenario:
+    def __init__(self, name: str, app: App, path: str, method='GET', query_string=None, json_data=None,
+                 data=None, status=200):
+        """
+
+        :param name: 场景名称
+        :param app: 处理请求的 App
+        :param path:
+        :param method:
+        :param query_string:
+        :param json_data: 以 JSON 格式提交的数据
+        :param data: 以表单格式提交的数据，包含文件时使用 multipart/form-data
+        :param status: 预期的响应状态码
+        """
+        from werkzeug.test import EnvironBuilder
+
+        self.name = name
+        self.app = app
+        self.status = status
+
+        builder = EnvironBuilder(path=path, method=method, query_string=query_string, json=json_data, data=data,
+                                 headers={'User-Agent': 'restfx-benchmark'},
+                                 environ_overrides={'REMOTE_ADDR': '127.0.0.1'})
+        self.environ = builder.get_environ()
+        # 请求体只生成一次，每次请求时使用新的流
+        self.body = self.environ['wsgi.input'].read()
+        builder.close()
+
+        self.cookie = None
+
+    def call(self):
+        """
+        发起一次请求，并读取完整的响应
+        :return: 响应的状态码
+        """
+        environ = dict(self.environ)
+        environ['wsgi.input'] = io.BytesIO(self.body)
+        if self.cookie:
+            environ['HTTP_COOKIE'] = self.cookie
+
+        state = []
+
+        def start_response(status, headers, exc_info=None):
+            state.append(status)
+            state.append(headers)
+
+        app_iter = self.app(environ, start_response)
+        try:
+            for _ in app_iter:
+                pass
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                close()
+
+        if self.cookie is None:
+            # 保存 session cookie，后续的请求会使用已经存在的 session
+            for name, value in state[1]:
+                if name.lower() == 'set-cookie':
+                    self.cookie = value.split(';', 1)[0]
+                    break
+            else:
+                self.cookie = ''
+
+        return int(state[0].split(' ', 1)[0])
+
+
+def create_app(app_id: str, *middlewares) -> App:
+    app = App(root, app_id=app_id, debug=False, api_page_enabled=False)
+    # 不输出日志，避免 IO 影响测试结果
+    app.set_logger(lambda level, message, e=None: None)
+    app.scan_routes()
+    if middlewares:
+        app.register_middleware(*middlewares)
+    return app
+
+
+def create_scenarios():
+    plain_app = create_app('benchmark-plain')
+    session_app = create_app('benchmark-session', SessionMiddleware(MemorySessionProvider()))
+    heavy_app = create_app('benchmark-heavy',
+                           TimetickMiddleware(),
+                           AccessMiddleware(),
+                           OptionsMiddleware(),
+                           SessionMiddleware(MemorySessionProvider()))
+
+    json_data = {'userName': 'restfx', 'tags': ['a', 'b', 'c'], 'score': 99.5}
+
+    return [
+        Scenario('get_query', plain_app, '/api/bench/items', query_string='a=1&b=hello&items[]=1&items[]=2'),
+        Scenario('json_post', plain_app, '/api/bench/items', method='POST', json_data=json_data),
+        Scenario('multipart_upload', plain_app, '/api/bench/items/upload', method='POST', data={
+            'name': 'restfx',
+            'file': (io.BytesIO(b'x' * 16 * 1024), 'upload.bin'),
+        }),
+        Scenario('not_found', plain_app, '/api/bench/missing', status=404),
+        Scenario('session', session_app, '/api/bench/items/session'),
+        Scenario('middleware_heavy', heavy_app, '/api/bench/items', query_string='a=1&b=hello'),
+    ]
+
+
+def _reset_peak():
+    # tracemalloc.reset_peak 需要 python 3.9+，低版本时重新开始跟踪
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.clear_traces()
+
+
+def percentile(values: list, percent: float) -> float:
+    """
+    :param values: 已排序的数据
+    :param percent: 0-100
+    :return:
+    """
+    if not values:
+        return 0
+    index = min(len(values) - 1, max(0, int(round(percent / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def run_scenario(scenario: Scenario, requests: int, warmup: int, rounds: int) -> dict:
+    for _ in range(warmup):
+        status = scenario.call()
+        if status != scenario.status:
+            raise Exception('Scenario %r returned status %s, expected %s' % (scenario.name, status,
+                                                                             scenario.status))
+
+    # 吞吐量与延迟，运行多轮并取最快的一轮，以减少系统负载波动的影响
+    elapsed = None
+    latencies = None
+    for _ in range(rounds):
+        round_latencies = []
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(requests):
+            begin = time.perf_counter()
+            scenario.call()
+            round_latencies.append(time.perf_counter() - begin)
+        round_elapsed = time.perf_counter() - start
+        if elapsed is None or round_elapsed < elapsed:
+            elapsed = round_elapsed
+            latencies = round_latencies
+    latencies.sort()
+
+    # 内存分配，单独运行以避免 tracemalloc 影响计时
+    alloc_requests = max(1, requests // 10)
+    peak_total = 0
+    tracemalloc.start()
+    try:
+        current_before, _ = tracemalloc.get_traced_memory()
+        for _ in range(alloc_requests):
+            current, _ = tracemalloc.get_traced_memory()
+            _reset_peak()
+            scenario.call()
+            _, peak = tracemalloc.get_traced_memory()
+            peak_total += peak - current
+        current_after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'rps': requests / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        # 每个请求处理过程中的内存峰值，以及请求结束后未释放的内存
+        'peak_kib_per_request': peak_total / alloc_requests / 1024,
+        'retained_bytes_per_request': (current_after - current_before) / alloc_requests,
+    }
+
+
+def print_results(results: dict, baseline: dict = None):
+    header = '%-18s %10s %9s %9s %10s %12s' % ('scenario', 'req/s', 'p50(ms)', 'p99(ms)', 'peak(KiB)',
+                                               'retained(B)')
+    if baseline:
+        header += ' %9s' % 'vs base'
+    print(header)
+    print('-' * len(header))
+
+    for name, result in results.items():
+        line = '%-18s %10.0f %9.3f %9.3f %10.2f %12.1f' % (
+            name, result['rps'], result['p50_ms'], result['p99_ms'], result['peak_kib_per_request'],
+            result['retained_bytes_per_request'])
+        if baseline:
+            base = baseline.get(name)
+            if base:
+                line += ' %+8.1f%%' % ((result['rps'] - base['rps']) / base['rps'] * 100)
+            else:
+                line += ' %9s' % '-'
+        print(line)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    与基准对比
+    :param results:
+    :param baseline:
+    :param threshold: 允许的吞吐量下降百分比
+    :return: 吞吐量下降超过阈值的场景名称
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = (result['rps'] - base['rps']) / base['rps'] * 100
+        if change < -threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='restfx request pipeline benchmark')
+    parser.add_argument('-s', '--scenarios', nargs='*', help='scenarios to run, all by default')
+    parser.add_argument('-n', '--requests', type=int, default=5000, help='requests per scenario')
+    parser.add_argument('-w', '--warmup', type=int, default=500, help='warmup requests per scenario')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='rounds per scenario, the fastest one is reported')
+    parser.add_argument('--save', help='save results into a baseline file')
+    parser.add_argument('--compare', help='compare results with a baseline file')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='allowed throughput drop in percent when comparing, 10 by default')
+    args = parser.parse_args()
+
+    # AccessMiddleware 使用标准库的 logging
+    logging.getLogger('restfx').setLevel(logging.CRITICAL)
+
+    scenarios = create_scenarios()
+    if args.scenarios:
+        unknown = set(args.scenarios) - set(scenario.name for scenario in scenarios)
+        if unknown:
+            parser.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+        scenarios = [scenario for scenario in scenarios if scenario.name in args.scenarios]
+
+    print('Python %s on %s' % (platform.python_version(), platform.platform()))
+    print('%d requests x %d rounds per scenario, %d warmup\n' % (args.requests, args.rounds, args.warmup))
+
+    results = {}
+    for scenario in scenarios:
+        results[scenario.name] = run_scenario(scenario, args.requests, args.warmup, args.rounds)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fp:
+            baseline = json.load(fp)['results']
+
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, mode='w', encoding='utf-8') as fp:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'results': results,
+            }, fp, indent=2)
+        print('\nResults saved into %s' % args.save)
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\nThroughput dropped more than %s%%: %s' % (args.threshold, ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
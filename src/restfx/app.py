@@ -2,6 +2,7 @@ import atexit
 import os
 import sys
 import uuid
+from functools import partial
 from types import FunctionType
 from typing import Union, Tuple, List
 
@@ -11,6 +12,7 @@ from .http import HttpRequest, NotFound, ServerError
 from .middleware import MiddlewareManager
 from .routes import Collector
 from .util import ContextStore, utils
+from .util.aio import run_steps
 
 
 class AppContext:
@@ -94,6 +96,7 @@ class App:
         from .config import AppConfig
         from .routes import ApiPage
         from .routes import Router
+        from .routes import StaticFiles
         from .util import Logger
 
         # 上下文需要先创建，以便后续的模块能直接使用
@@ -114,11 +117,30 @@ class App:
         self.api_prefix = api_prefix
         self.router = Router(self.config)
         self.api_page = ApiPage(self.config)
+        self.static = StaticFiles(self.config)
+        # 映射到根路径的静态目录不处理接口请求
+        self.static.exclude('/%s' % api_prefix)
+        self.static.exclude('/%s/<path:entry>' % api_prefix)
 
         self.custom_url_map = {}
 
+        # ASGI 入口，在首次访问 asgi 属性时创建
+        self._asgi = None
+
         self.favicon = favicon
 
+        # 接口请求的路径前缀，用于在不经过 url_map 匹配的情况下，直接识别出接口请求
+        # 自定义的 url 映射与此前缀冲突时，会被设置为 None
+        self._entry_prefix = '/%s/' % api_prefix
+        # 接口页面使用的路径，这些路径不能直接作为接口处理
+        self._reserved_entries = ('api.json', 'export')
+
+        import werkzeug
+        sv = sys.version_info
+        self.server_header = '%s/%s werkzeug/%s Python/%s' % (
+            __meta__.name, __meta__.version, werkzeug.__version__, '%s.%s.%s' % (sv[0], sv[1], sv[2])
+        )
+
         from werkzeug.routing import Map, Rule
         self.url_map = Map([
             Rule('/favicon.ico', endpoint='favicon'),
@@ -137,6 +159,8 @@ class App:
             self.INSTANCES.pop(self.id)
 
         self.config.middleware_manager.handle_shutdown()
+        if self._asgi is not None:
+            self._asgi.shutdown()
 
         self.context.pop()
         self.config.dispose()
@@ -151,66 +175,124 @@ class App:
         :param start_response:
         :return:
         """
+        request = HttpRequest(environ, self)
+        request.context().push()
+        try:
+            response = run_steps(self.handle_steps(request))
+        finally:
+            request.context().pop()
+        return response(environ, start_response)
 
-        request = None
+    def handle_steps(self, request: HttpRequest):
+        """
+        请求的处理流程，WSGI 与 ASGI 共用此流程，见 util.aio
+        :param request:
+        :return:
+        """
         response = None
         try:
-            request = HttpRequest(environ, self)
-            request.context().push()
-
-            response = self.config.middleware_manager.handle_coming(request)
+            # 静态资源不经过中间件的 on_coming (如 SessionMiddleware)，
+            # 只在路径匹配，并且未知文件不存在时才需要访问文件系统
+            matched = self.static.match_request(request)
+            if matched is not None and self.static.maybe_exists(matched[1]):
+                response = yield self.static.dispatch, (request, matched), True
+                if response is not None:
+                    return (yield from self._leave_steps(request, response))
+
+            response = yield from self.config.middleware_manager.coming_steps(request)
+            if not response:
+                entry = self._match_entry(request.path)
+                if entry is not None:
+                    response = yield from self.router.dispatch_steps(request, entry)
             if not response:
-                adapter = self.url_map.bind_to_environ(environ)
+                adapter = self.url_map.bind_to_environ(request.environ)
 
                 endpoint, values = adapter.match()
                 if endpoint == '_api_page':
-                    response = self.api_page.dispatch(request)
+                    response = yield self.api_page.dispatch, (request,), True
                 elif endpoint == 'entry_only':
-                    response = self.router.dispatch(request, values['entry'])
+                    response = yield from self.router.dispatch_steps(request, values['entry'])
                 elif endpoint in self.custom_url_map:
-                    response = self.custom_url_map[endpoint](request, **values)
+                    response = yield partial(self.custom_url_map[endpoint], request, **values), (), True
                 elif endpoint == 'favicon':
                     if self.favicon is None:
                         response = NotFound()
                     else:
                         from .http import FileResponse
-                        response = FileResponse(os.path.join(self.config.ROOT, self.favicon))
+                        response = yield partial(FileResponse, os.path.join(self.config.ROOT, self.favicon),
+                                                 request=request), (), True
                 else:
                     response = NotFound()
         except Exception as e:
-            from werkzeug.routing import RequestRedirect
-            if isinstance(e, RequestRedirect):
-                self._logger.debug('Redirect url %r with code %s' % (e.new_url, e.code))
-                from restfx.http import Redirect
-                response = Redirect(e.new_url, e.code)
-            # 忽略静态资源请求的 .js.map/.css.map 文件
-            elif request and (request.path.lower().endswith('.js.map') or request.path.lower().endswith('.css.map')):
-                response = NotFound()
-            else:
-                from werkzeug.exceptions import NotFound as SuperNotFound
-                if isinstance(e, SuperNotFound):
-                    response = NotFound()
-                else:
-                    msg = utils.get_exception_info(e)
-                    if request:
-                        msg = 'Error occurred during handling request %r:\n\t%s' % (request.path, msg)
+            response = self._get_error_response(request, e)
 
-                    self._logger.error(msg)
-                    if self.config.debug:
-                        response = ServerError(msg.replace('<', '&lt;').replace('>', '&gt;'))
-                    else:
-                        response = ServerError()
-        finally:
-            result = self.config.middleware_manager.handle_leaving(request, response)
-            if result:
-                response = result
-            request.context().pop()
-            import werkzeug
-            sv = sys.version_info
-            response.headers['server'] = '%s/%s werkzeug/%s Python/%s' % (
-                __meta__.name, __meta__.version, werkzeug.__version__, '%s.%s.%s' % (sv[0], sv[1], sv[2])
-            )
-        return response(environ, start_response)
+        return (yield from self._leave_steps(request, response))
+
+    def _leave_steps(self, request: HttpRequest, response):
+        result = yield from self.config.middleware_manager.leaving_steps(request, response)
+        if result:
+            response = result
+        response.headers['server'] = self.server_header
+        return response
+
+    def _get_error_response(self, request: HttpRequest, e: Exception):
+        from werkzeug.routing import RequestRedirect
+        if isinstance(e, RequestRedirect):
+            self._logger.debug('Redirect url %r with code %s' % (e.new_url, e.code))
+            from restfx.http import Redirect
+            return Redirect(e.new_url, e.code)
+
+        # 忽略静态资源请求的 .js.map/.css.map 文件
+        if request.path.lower().endswith('.js.map') or request.path.lower().endswith('.css.map'):
+            return NotFound()
+
+        from werkzeug.exceptions import NotFound as SuperNotFound
+        if isinstance(e, SuperNotFound):
+            return NotFound()
+
+        msg = utils.get_exception_info(e)
+        msg = 'Error occurred during handling request %r:\n\t%s' % (request.path, msg)
+
+        self._logger.error(msg)
+        if self.config.debug:
+            return ServerError(msg.replace('<', '&lt;').replace('>', '&gt;'))
+        return ServerError()
+
+    def _match_entry(self, path: str):
+        """
+        不经过 url_map，直接从请求路径中识别出接口的入口地址。
+        只处理能确定匹配 entry_only 规则的路径，其它路径 (如需要重定向的路径) 返回 None，交由 url_map 处理
+        :param path:
+        :return:
+        """
+        prefix = self._entry_prefix
+        if prefix is None or not path.startswith(prefix) or '//' in path:
+            return None
+
+        entry = path[len(prefix):]
+        if self.config.append_slash:
+            if not entry.endswith('/'):
+                return None
+            entry = entry[:-1]
+        elif entry.endswith('/'):
+            return None
+
+        if not entry or entry in self._reserved_entries:
+            return None
+        return entry
+
+    @property
+    def asgi(self):
+        """
+        ASGI 入口，例如: uvicorn main:app.asgi
+        需要指定线程池大小时，可以使用 restfx.asgi.AsgiHandler(app, max_workers)
+        :return:
+        :rtype: AsgiHandler
+        """
+        if self._asgi is None:
+            from .asgi import AsgiHandler
+            self._asgi = AsgiHandler(self)
+        return self._asgi
 
     def __call__(self, environ, start_response):
         """
@@ -219,12 +301,7 @@ class App:
         :param start_response:
         :return:
         """
-        if not self.config.static_map:
-            return self.handle_wsgi_request(environ, start_response)
-
-        from werkzeug.middleware.shared_data import SharedDataMiddleware
-        return SharedDataMiddleware(self.handle_wsgi_request, self.config.static_map)(
-            environ, start_response)
+        return self.handle_wsgi_request(environ, start_response)
 
     def startup(self, host=None, port=9127, threaded=True, **kwargs):
         """
@@ -342,6 +419,19 @@ class App:
         run_simple(host, port, self, use_debugger=False, use_reloader=debug, threaded=threaded,
                    exclude_patterns=exclude_patterns, **kwargs)
 
+    def serve(self, host=None, port=9127, workers: int = None, **kwargs):
+        """
+        使用内置的多进程 (pre-fork) 服务器运行应用，用于生产环境，不支持 Windows。
+        也可以通过命令 restfx serve module:app 启动
+        :param host:
+        :param port:
+        :param workers: worker 进程数量，不指定时为 cpu 数量
+        :param kwargs: 适用于 server.PreforkServer 的其它参数，如 threads, queue_size, max_requests, reuse_port 等
+        :return:
+        """
+        from .server import PreforkServer
+        PreforkServer(self, host, port, workers, **kwargs).run()
+
     def register_types(self, *types):
         """
         注册路由参数上使用的类型，目前仅支持枚举类型
@@ -351,26 +441,55 @@ class App:
         collector = Collector.get(self.id)
         for type_item in types:
             collector.global_types[type_item.__name__] = type_item
+        # 装饰器参数的解析依赖注册的类型
+        collector.clear_cache()
+
+        return self
+
+    def set_json_backend(self, backend: str = None):
+        """
+        指定序列化 JSON 时使用的后端，默认使用标准库 json
+        :param backend: 可选值为 orjson, ujson, json，为 None 时自动选择第一个可用的后端 (orjson, ujson, json)
+        :return:
+        """
+        self.config.serializer.use(backend)
+        return self
 
+    def register_json_type(self, type_: type, handler: FunctionType):
+        """
+        注册 JSON 序列化时使用的自定义类型
+        :param type_: 自定义类型
+        :param handler: 将该类型的对象转换为可序列化对象的函数，其接收一个参数：要序列化的对象
+        :return:
+        """
+        self.config.serializer.register_type(type_, handler)
         return self
 
-    def collect(self):
+    def collect(self, workers: int = None):
         """
         收集路由
+        :param workers: 并行收集时使用的线程数量，不指定时串行收集
         :return:
         """
-        return Collector.get(self.id).collect(self.config.routes_map)
+        self.router.compile_routes()
+        return Collector.get(self.id).collect(self.config.routes_map, workers)
 
-    def persist(self, filename: str = 'dist/routes_map.py', encoding='utf8'):
+    def persist(self, filename: str = 'dist/routes_map.py', encoding='utf8', workers: int = None,
+                incremental=False, bundle=False, lazy=False):
         """
         持久化路由信息到文件
         :param encoding: 文件编码
         :param filename: 输出的路由文件名称
+        :param workers: 并行收集时使用的线程数量，不指定时串行收集
+        :param incremental: 是否增量生成，启用时仅重新处理内容发生变化的路由文件
+        :param bundle: 是否同时生成预编译的路由包，生成的路由包可通过 register_bundle 注册
+        :param lazy: 是否生成延迟加载的路由文件，其中的路由函数所在模块在首次请求时才会导入
         :return:
         """
         routes_file = os.path.basename(filename)
         routes_dir = os.path.dirname(filename)
-        return Collector.get(self.id).persist(self.config.routes_map, routes_file, routes_dir, encoding)
+        return Collector.get(self.id).persist(self.config.routes_map, routes_file, routes_dir, encoding, workers,
+                                              incremental, bundle, lazy)
 
     def set_logger(self, logger):
         """
@@ -392,6 +511,12 @@ class App:
         for url in urls_map:
             self.custom_url_map[url] = urls_map[url]
             self.url_map.add(Rule(url, endpoint=url))
+            self.static.exclude(url)
+            # 自定义的 url 可能会匹配接口请求的路径，此时接口请求需要经过 url_map 匹配
+            static_part = url.split('<', 1)[0]
+            if self._entry_prefix is not None and (
+                    static_part.startswith(self._entry_prefix) or self._entry_prefix.startswith(static_part)):
+                self._entry_prefix = None
         return self
 
     def map_routes(self, routes_map: dict):
@@ -409,12 +534,14 @@ class App:
                 if not os.path.exists(pkg_path):
                     self._logger.warning('Route map "%s" does not exist, path=%s' % (pkg, pkg_path))
             self.config.routes_map[path] = pkg
+        self.router.route_table.invalidate()
         return self
 
-    def map_static(self, static_map: dict):
+    def map_static(self, static_map: dict, memory_cache=False):
         """
         设置静态资源目录映射
         :param static_map:
+        :param memory_cache: 是否将这些目录下的小文件缓存在内存中
         :return:
         """
         for prefix in static_map:
@@ -431,11 +558,14 @@ class App:
             abs_target_path = os.path.abspath(os.path.join(self.config.ROOT, target_path))
             # 无论目录是否存在都注册，因为静态目录可能是动态生成的
             self.config.static_map[prefix] = abs_target_path
+            if memory_cache:
+                self.static.memory_prefixes.add(prefix.rstrip('/'))
             if os.path.exists(abs_target_path):
                 self._logger.debug('Map static url %s to path %s' % (prefix, abs_target_path))
             else:
                 self._logger.warning(
                     'The target path of static url %s not found: %s' % (prefix, abs_target_path))
+        self.static.invalidate()
         return self
 
     def register_routes(self, routes: list):
@@ -446,7 +576,9 @@ class App:
 
         app.register_routes(routes_map.routes)
 
-        :param routes: 其每一项都应该是一个 list, 元素依次为 method: str, path: str, handler: FunctionType
+        :param routes: 其每一项都应该是一个 list, 元素依次为 handler, api_info。
+        handler 为字符串 "模块:函数名称" 时 (由 persist(..., lazy=True) 生成)，路由函数所在模块在首次请求时才会导入，
+        可以调用 warmup 提前加载
         :return:
         """
         for handler, api_info in routes:
@@ -456,18 +588,79 @@ class App:
             path = api_info['path']
 
             rid = '%s#%s' % (path, method.lower())
-            if rid in self.router.production_routes:
-                self._logger.warning('Duplicated route %s %s' % (method, path))
 
-            desc = FunctionDescription(handler)
-            self.router.production_routes[rid] = {
-                'func': handler,
-                'args': desc.arguments
-            }
+            if isinstance(handler, str):
+                pkg, func_name = handler.rsplit(':', 1)
+                added = self.router.route_table.add_lazy(rid, pkg, func_name)
+            else:
+                desc = FunctionDescription(handler)
+                added = self.router.route_table.add(rid, {
+                    'func': handler,
+                    'args': desc.arguments
+                })
+            if not added:
+                self._logger.warning('Duplicated route %s %s' % (method, path))
             self.config.docs.append(api_info)
 
+        self.router.compile_routes()
         return self
 
+    def register_bundle(self, filename: str = 'dist/routes_map.bundle'):
+        """
+        注册由 persist(..., bundle=True) 生成的预编译路由包。
+        与 register_routes 不同，路由函数所在的模块在首次请求时才会导入，参数描述也在此时才会反序列化
+
+        :param filename: 路由包文件，相对路径时相对于应用的根目录
+        :return:
+        """
+        import pickle
+
+        if not os.path.isabs(filename):
+            filename = os.path.join(self.config.ROOT, filename)
+
+        with open(filename, mode='rb') as fp:
+            bundle = pickle.load(fp)
+
+        if bundle['version'] != __meta__.version:
+            self._logger.warning('The routes bundle %s is generated by %s %s, regenerate it please' % (
+                filename, __meta__.name, bundle['version']))
+
+        for record in bundle['routes']:
+            method, path, pkg, handler, args_data, doc_data = pickle.loads(record)
+
+            rid = '%s#%s' % (path, method.lower())
+            if not self.router.route_table.add_lazy(rid, pkg, handler, args_data):
+                self._logger.warning('Duplicated route %s %s' % (method, path))
+
+            # 接口文档仅用于接口页面
+            if self.config.api_page_enabled:
+                self.config.docs.append(pickle.loads(doc_data))
+
+        self.router.compile_routes()
+        return self
+
+    def warmup(self, background=False):
+        """
+        提前加载所有延迟加载的路由 (通过 register_bundle 或者延迟加载的路由文件注册)。
+        使用多进程服务器时，可以在主进程 fork 前调用，以使子进程共享已经加载的模块
+        :param background: 是否在后台线程中加载
+        :return: 在后台加载时返回加载线程，否则返回加载的路由数量
+        """
+        if not background:
+            return self.router.route_table.warmup(self._logger)
+
+        import threading
+
+        def warmup():
+            # 后台线程中没有应用上下文
+            with self.context:
+                count = self.router.route_table.warmup(self._logger)
+            self._logger.debug('%d route(s) loaded in background' % count)
+
+        thread = threading.Thread(target=warmup, name='restfx-warmup', daemon=True)
+        thread.start()
+        return thread
+
     def register_middleware(self, *middlewares, index: int = -1):
         """
         注册中间件，注册的中间件将按顺序执行
@@ -476,6 +669,7 @@ class App:
         :return:
         """
         from .middleware import MiddlewareBase
+        from .util.aio import is_async_callable, run_sync
 
         for middleware in middlewares:
             assert isinstance(middleware, MiddlewareBase)
@@ -491,7 +685,10 @@ class App:
                 # 每添加一个，将 index 后移动一个位置
                 index += 1
             # 调用中间件，标记中间件的启动
-            middleware.on_startup(self)
+            if is_async_callable(middleware.on_startup):
+                run_sync(middleware.on_startup(self))
+            else:
+                middleware.on_startup(self)
 
         return self
 
@@ -0,0 +1,204 @@
+import asyncio
+import contextvars
+import io
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .http import HttpRequest
+from .util.aio import run_steps_async
+
+# a singleton sentinel value for parameter defaults
+_sentinel = object()
+
+
+class AsgiHandler:
+    """
+    App 的 ASGI 入口，通过 App.asgi 获取，例如: uvicorn main:app.asgi
+
+    - async def 路由函数以及中间件的 async def 勾子函数在事件循环中直接执行
+    - 同步的路由函数、静态文件等可能阻塞的调用在有上限的线程池中执行
+    - 请求上下文基于 contextvars，每个请求 (asyncio 任务) 相互隔离
+    - 请求体写入 SpooledTemporaryFile，超过 spool_size 的部分写入临时文件，而不是全部保存在内存中
+    """
+
+    def __init__(self, app, max_workers: int = None, spool_size: int = 1024 * 1024):
+        """
+
+        :param app: App 实例
+        :param max_workers: 执行同步调用的线程池的最大线程数量，为 None 时使用 min(32, cpu 数量 + 4)
+        :param spool_size: 请求体保存在内存中的最大字节数，超过时写入临时文件
+        """
+        self.app = app
+        self.max_workers = max_workers
+        self.spool_size = spool_size
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='restfx-asgi')
+        return self._executor
+
+    def run_blocking(self, func, *args):
+        """
+        在线程池中执行阻塞调用，调用时保持当前的上下文
+        :param func:
+        :param args:
+        :return:
+        """
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(self.executor, partial(context.run, func, *args))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def __call__(self, scope, receive, send):
+        scope_type = scope['type']
+        if scope_type == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope_type == 'lifespan':
+            await self.handle_lifespan(receive, send)
+        else:
+            raise NotImplementedError('Unsupported ASGI scope type: %s' % scope_type)
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle_http(self, scope, receive, send):
+        body, size = await self._read_body(receive)
+        try:
+            await self._handle_http(scope, send, body, size)
+        finally:
+            body.close()
+
+    async def _handle_http(self, scope, send, body, size: int):
+        environ = self.get_environ(scope, body, size)
+
+        request = HttpRequest(environ, self.app)
+        request.context().push()
+        try:
+            response = await run_steps_async(self.app.handle_steps(request), self.run_blocking)
+        finally:
+            request.context().pop()
+
+        app_iter, status, headers = response.get_wsgi_response(environ)
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [
+                (name.lower().encode('latin1'), value.encode('latin1'))
+                for name, value in headers
+            ],
+        })
+
+        # 已经在内存中的数据直接发送，其它的数据 (文件、生成器等) 在线程池中读取
+        if isinstance(app_iter, (list, tuple)):
+            await send({'type': 'http.response.body', 'body': b''.join(app_iter)})
+            return
+
+        iterator = iter(app_iter)
+        try:
+            while True:
+                chunk = await self.run_blocking(next, iterator, _sentinel)
+                if chunk is _sentinel:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                await self.run_blocking(close)
+
+    async def _read_body(self, receive):
+        """
+        读取请求体
+        :param receive:
+        :return: (请求体文件，请求体大小)
+        """
+        body = tempfile.SpooledTemporaryFile(self.spool_size)
+        size = 0
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    break
+                chunk = message.get('body', b'')
+                if chunk:
+                    size += len(chunk)
+                    if size > self.spool_size:
+                        # 超过 spool_size 后写入的是磁盘文件
+                        await self.run_blocking(body.write, chunk)
+                    else:
+                        body.write(chunk)
+                if not message.get('more_body', False):
+                    break
+        except BaseException as e:
+            body.close()
+            raise e
+        body.seek(0)
+        return body, size
+
+    @staticmethod
+    def get_environ(scope, body, size: int = None) -> dict:
+        """
+        根据 ASGI 的 scope 生成 WSGI environ
+        :param scope:
+        :param body: 请求体，bytes 或者可读的文件对象
+        :param size: 请求体的大小，body 为 bytes 时可以不指定
+        :return:
+        """
+        if isinstance(body, (bytes, bytearray)):
+            size = len(body)
+            body = io.BytesIO(body)
+
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'CONTENT_LENGTH': str(size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'asgi.scope': scope,
+        }
+
+        client = scope.get('client')
+        if client:
+            environ['REMOTE_ADDR'] = client[0]
+            environ['REMOTE_PORT'] = str(client[1])
+
+        for name, value in scope.get('headers', ()):
+            name = name.decode('latin1')
+            value = value.decode('latin1')
+            if name == 'content-length':
+                continue
+            if name == 'content-type':
+                key = 'CONTENT_TYPE'
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+            if key in environ:
+                value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+            environ[key] = value
+
+        return environ
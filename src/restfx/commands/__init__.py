@@ -6,13 +6,16 @@ from .commands import (
     register,
     command_help,
     command_create,
-    command_version, command_genid
+    command_version, command_genid,
+    command_serve
 )
 
 register('help', command_help, 'Show this help message')
 register('version', command_version, 'Show the version information')
 register('create', command_create, 'Create restfx project structure', 'project-name')
 register('genid', command_genid, 'Generate a new id for app')
+register('serve', command_serve, 'Start the pre-fork production server',
+         'module:app [-b host:port] [-w workers] [-t threads] [--queue-size n] [--max-requests n] [--reuse-port]')
 
 
 def execute(*args, **kwargs):
@@ -38,5 +41,6 @@ __all__ = [
     'command_create',
     'command_version',
     'command_genid',
+    'command_serve',
     'execute'
 ]
@@ -76,6 +76,59 @@ def command_version(*argv):
     print('Version: ' + __meta__.version)
 
 
+def command_serve(working_dir: str, *argv):
+    import argparse
+    import importlib
+
+    parser = argparse.ArgumentParser(prog='%s serve' % __meta__.name,
+                                     description='Start the pre-fork production server')
+    parser.add_argument('app', help='the application in the form of "module:attribute", '
+                                    'the attribute can be an App instance or a function that returns one')
+    parser.add_argument('-b', '--bind', help='the address to bind in the form of "host:port", '
+                                             'RESTFX_HOST:RESTFX_PORT or 127.0.0.1:9127 by default')
+    parser.add_argument('-w', '--workers', type=int, help='the number of worker processes, cpu count by default')
+    parser.add_argument('-t', '--threads', type=int, default=16,
+                        help='the number of request threads per worker, 0 means one thread per connection')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='the number of connections waiting for a thread per worker, '
+                             'respond 503 when the queue is full')
+    parser.add_argument('--max-requests', type=int, default=0,
+                        help='restart a worker after it has handled this many requests, 0 means no limit')
+    parser.add_argument('--max-requests-jitter', type=int, default=0,
+                        help='add a random value in [0, jitter] to max-requests of each worker')
+    parser.add_argument('--graceful-timeout', type=float, default=30,
+                        help='seconds to wait for the unfinished requests when stopping a worker')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='let each worker listen on its own socket with SO_REUSEPORT')
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help='seconds between worker statistics logs (queue time, rejected requests), 0 to disable')
+    args = parser.parse_args(argv)
+
+    if args.bind:
+        host, _, port = args.bind.rpartition(':')
+    else:
+        host = os.environ.get('RESTFX_HOST')
+        port = os.environ.get('RESTFX_PORT', 9127)
+
+    module_name, _, attr_name = args.app.partition(':')
+    if working_dir not in sys.path:
+        sys.path.insert(0, working_dir)
+    app = getattr(importlib.import_module(module_name), attr_name or 'app')
+
+    from ..app import App
+    if not isinstance(app, App):
+        app = app()
+
+    app.serve(host, int(port), args.workers,
+              threads=args.threads,
+              queue_size=args.queue_size,
+              max_requests=args.max_requests,
+              max_requests_jitter=args.max_requests_jitter,
+              graceful_timeout=args.graceful_timeout,
+              reuse_port=args.reuse_port,
+              stats_interval=args.stats_interval)
+
+
 # noinspection PyUnusedLocal
 def command_create(working_dir: str, project_name, *argv):
     print('working-dir:' + working_dir)
@@ -4,6 +4,7 @@ from werkzeug.local import LocalStack
 
 from . import __meta__
 from .util import Logger
+from .util.serializer import JsonSerializer
 
 
 class AppConfig:
@@ -79,6 +80,11 @@ class AppConfig:
 
         self.static_map = {}
 
+        self.serializer = JsonSerializer()
+        """
+        JSON 序列化器，用于解析请求中的 json 数据以及序列化 JsonResponse
+        """
+
         # 注入数据/函数集合
         # 其中存放将被注入到路由函数参数列表上的数据/函数
         self.injections = {}
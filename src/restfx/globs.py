@@ -1,7 +1,7 @@
+from contextvars import ContextVar
 from functools import partial
 
 from werkzeug.local import LocalProxy
-from werkzeug.local import LocalStack
 
 _request_ctx_err_msg = """\
 Working outside of request context.
@@ -20,6 +20,31 @@ documentation for more information.\
 """
 
 
+class ContextStack:
+    """
+    基于 contextvars 的上下文栈，在不同的线程以及 asyncio 任务之间相互隔离
+    """
+
+    def __init__(self, name: str):
+        # 栈使用不可变的 tuple 存储，修改时生成新的 tuple，以免影响其它上下文中的栈
+        self._stack = ContextVar(name, default=())
+
+    def push(self, obj):
+        self._stack.set(self._stack.get() + (obj,))
+
+    def pop(self):
+        stack = self._stack.get()
+        if not stack:
+            return None
+        self._stack.set(stack[:-1])
+        return stack[-1]
+
+    @property
+    def top(self):
+        stack = self._stack.get()
+        return stack[-1] if stack else None
+
+
 def _lookup_req_object(name):
     top = _request_ctx_stack.top
     if top is None:
@@ -42,8 +67,8 @@ def _find_app():
 
 
 # context locals
-_request_ctx_stack = LocalStack()
-_app_ctx_stack = LocalStack()
+_request_ctx_stack = ContextStack('restfx.request_ctx')
+_app_ctx_stack = ContextStack('restfx.app_ctx')
 
 current_app = LocalProxy(_find_app)
 request = LocalProxy(partial(_lookup_req_object, "request"))
@@ -1,10 +1,13 @@
 from .request import HttpRequest, HttpFile
+from .stream import ResponseStream
 from .response import (
     HttpResponse,
     ServerError,
     BadRequest,
     NotFound,
     JsonResponse,
+    JsonStreamResponse,
+    StreamResponse,
     FileResponse,
     Redirect, Unauthorized
 )
@@ -15,6 +18,9 @@ __all__ = [
     'HttpResponse',
     'FileResponse',
     'JsonResponse',
+    'JsonStreamResponse',
+    'StreamResponse',
+    'ResponseStream',
     'Redirect',
     'BadRequest',
     'Unauthorized',
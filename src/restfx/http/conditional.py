@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+# 304 响应需要保留的响应头
+_NOT_MODIFIED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Content-Location', 'Expires', 'Vary')
+
+
+def _get_datetime(value: Union[datetime, int, float, str, None]) -> Optional[datetime]:
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc)
+    if isinstance(value, str):
+        from werkzeug.http import parse_date
+        return parse_date(value)
+    return value
+
+
+def is_modified(request, etag: str = None, last_modified: Union[datetime, int, float, str] = None) -> bool:
+    """
+    根据请求头 If-None-Match 和 If-Modified-Since 判断资源是否已经变化
+    :param request:
+    :param etag: 资源当前的 ETag (不含引号)
+    :param last_modified: 资源的最后修改时间，可以是 datetime，时间戳或者 http 日期字符串
+    :return: 资源已经变化 (需要返回完整的数据) 时返回 True
+    """
+    from werkzeug.http import is_resource_modified
+    return is_resource_modified(request.environ, etag=etag, last_modified=_get_datetime(last_modified))
+
+
+def get_etag(response) -> Optional[str]:
+    """
+    获取响应的 ETag (不含引号)。响应中没有 ETag 时，根据响应的内容计算。流式响应不会计算 ETag
+    :param response:
+    :return:
+    """
+    etag, _ = response.get_etag()
+    if etag is not None:
+        return etag
+
+    if response.is_streamed or response.direct_passthrough:
+        return None
+
+    from ..util import md5
+    return md5.hash_str(response.get_data())
+
+
+def not_modified(response=None, headers: dict = None):
+    """
+    生成 304 响应
+    :param response: 原响应，会保留其中的缓存相关的响应头，并关闭原响应
+    :param headers: 额外的响应头
+    :return:
+    """
+    from .response import HttpResponse
+    result = HttpResponse(status=304, headers=headers)
+    if response is not None:
+        for name in _NOT_MODIFIED_HEADERS:
+            if name in response.headers and name not in result.headers:
+                result.headers[name] = response.headers[name]
+        response.close()
+    return result
+
+
+def make_conditional(request, response, etag: Union[str, bool] = True,
+                     last_modified: Union[datetime, int, float, str] = None,
+                     cache_control: str = None):
+    """
+    为 GET/HEAD 请求的 200 响应添加 ETag/Last-Modified/Cache-Control 响应头，在资源未变化时返回 304 响应
+    :param request:
+    :param response:
+    :param etag: 资源的 ETag (不含引号)，为 True 时使用响应中的 ETag 或者根据响应内容计算，为 None 时不使用 ETag
+    :param last_modified: 资源的最后修改时间
+    :param cache_control: Cache-Control 响应头的值
+    :return:
+    """
+    if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+        return response
+
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+
+    if etag is True:
+        etag = get_etag(response)
+    elif etag is False:
+        etag = None
+    if etag is not None:
+        response.set_etag(etag)
+
+    last_modified = _get_datetime(last_modified)
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+    if etag is None and last_modified is None:
+        return response
+
+    if is_modified(request, etag, last_modified):
+        return response
+
+    return not_modified(response)
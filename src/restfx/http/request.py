@@ -2,6 +2,7 @@ import uuid
 
 from werkzeug import Request
 from werkzeug.datastructures import ImmutableDict, FileStorage, MultiDict
+from werkzeug.utils import cached_property
 
 from ..globs import _request_ctx_stack, _app_ctx_stack
 from ..session import HttpSession
@@ -75,11 +76,6 @@ class HttpRequest(Request):
         self.id = uuid.uuid4().hex
         self.app = app
         self.app_id = app.id
-        self.GET = _get_request_data(self.args)
-        self.POST = _get_request_data(self.form)
-        self.BODY = self.data
-        self.FILES = _get_files(self.files)
-        self.COOKIES = self.cookies
         self.session = None
         """
         :type: HttpSession
@@ -90,6 +86,40 @@ class HttpRequest(Request):
         # 在同一个请求中，使用同一个请求上下文
         self._ctx = RequestContext(self)
 
+    # 以下请求数据在首次访问时才会解析，并缓存解析结果
+    # 这样在中间件拒绝请求时，不会读取和解析请求体
+    # 这些属性可以被重新赋值（例如解析 json 后赋值给 BODY）
+
+    @cached_property
+    def GET(self) -> ImmutableDict:
+        return _get_request_data(self.args)
+
+    @cached_property
+    def POST(self) -> ImmutableDict:
+        return _get_request_data(self.form)
+
+    @cached_property
+    def BODY(self):
+        body = self.data
+        # 如果请求是json类型，就先处理一下
+        if not body or self.content_type is None or 'application/json' not in self.content_type:
+            return body
+
+        try:
+            return self.app.config.serializer.loads(body)
+        except Exception as e:
+            from ..util import Logger
+            Logger.get(self.app_id).warning('Failed to deserialize request body: %s' % str(e))
+            return body
+
+    @cached_property
+    def FILES(self) -> ImmutableDict:
+        return _get_files(self.files)
+
+    @cached_property
+    def COOKIES(self):
+        return self.cookies
+
     def inject(self, **kwargs):
         self._injections.update(kwargs)
 
@@ -1,10 +1,15 @@
-import json
+import os
+import stat
+from functools import partial
 from io import BytesIO, IOBase
-from typing import Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 from werkzeug.exceptions import InternalServerError
+from werkzeug.http import http_date
 from werkzeug.wrappers import Response
 
+from .stream import ResponseStream
+
 
 class HttpResponse(Response):
     def __init__(self, content=None, content_type='text/html;charset=utf-8',
@@ -15,29 +20,162 @@ class HttpResponse(Response):
 
 class JsonResponse(HttpResponse):
     def __init__(self, obj, encoder=None, content_type='application/json;charset=utf-8',
-                 ensure_ascii=True, **kwargs):
-        content = json.dumps(obj, ensure_ascii=ensure_ascii, cls=encoder)
+                 ensure_ascii=None, **kwargs):
+        """
+
+        :param obj: 要序列化的数据
+        :param encoder: json.JSONEncoder 的子类，用于序列化自定义类型
+        :param content_type:
+        :param ensure_ascii: 是否将非 ASCII 字符转义，为 None 时由使用的 JSON 后端决定
+        :param kwargs:
+        """
+        from ..util import serializer
+        content = serializer.current().dumps(obj, encoder=encoder, ensure_ascii=ensure_ascii)
+        super().__init__(content, content_type=content_type, **kwargs)
+
+
+class JsonStreamResponse(HttpResponse):
+    """
+    以流的方式返回 JSON 数组，适用于数据量很大的列表或者生成器
+
+    数组项会在写出响应时才逐个序列化，并合并成块后写出，不会在内存中生成完整的 JSON 数据
+    """
+
+    # 默认的写出块大小 (字节)
+    CHUNK_SIZE = 8192
+
+    def __init__(self, iterable, encoder=None, content_type='application/json;charset=utf-8',
+                 ensure_ascii=None, chunk_size: int = None, **kwargs):
+        """
+
+        :param iterable: 数组项的集合，可以是列表、迭代器或者生成器
+        :param encoder: json.JSONEncoder 的子类，用于序列化自定义类型
+        :param content_type:
+        :param ensure_ascii: 是否将非 ASCII 字符转义，为 None 时由使用的 JSON 后端决定
+        :param chunk_size: 写出块大小 (字节)，为 None 时使用 CHUNK_SIZE
+        :param kwargs:
+        """
+        from ..util import serializer
+        # 在写出响应时可能已经不在应用上下文中了，所以要先获取序列化器
+        dumps = partial(serializer.current().dumps, encoder=encoder, ensure_ascii=ensure_ascii)
+        self.source = iterable if isinstance(iterable, ResponseStream) else ResponseStream(iterable)
+        """
+        数据流，可以在写出响应前通过其 map 函数处理数组项
+        """
+        content = self._generate(self.source, dumps, chunk_size or self.CHUNK_SIZE)
+        super().__init__(content, content_type=content_type, **kwargs)
+
+    @staticmethod
+    def _generate(source: ResponseStream, dumps, chunk_size: int):
+        buffer = [b'[']
+        size = 1
+        separator = b''
+        try:
+            for item in source:
+                data = dumps(item)
+                buffer.append(separator)
+                buffer.append(data)
+                separator = b','
+                size += len(data) + 1
+                if size < chunk_size:
+                    continue
+                yield b''.join(buffer)
+                buffer.clear()
+                size = 0
+            buffer.append(b']')
+            yield b''.join(buffer)
+        finally:
+            source.close()
+
+
+class StreamResponse(HttpResponse):
+    """
+    以流的方式返回 bytes 或 str 数据块，适用于大文件导出 (如 CSV)、日志输出等场景
+
+    较小的数据块会被合并后再写出，以减少写出次数
+    """
+
+    # 默认的合并块大小 (字节)
+    CHUNK_SIZE = 8192
+
+    def __init__(self, iterable, content_type=None, chunk_size: int = None, encoding='utf-8', **kwargs):
+        """
+
+        :param iterable: 数据块的集合，可以是列表、迭代器或者生成器，数据块的类型为 bytes 或 str
+        :param content_type: 为 None 时，根据第一个数据块的类型确定
+        :param chunk_size: 合并块大小 (字节)，为 None 时使用 CHUNK_SIZE，为 0 时不合并，每个数据块都会立即写出
+        :param encoding: str 类型的数据块使用的编码
+        :param kwargs:
+        """
+        self.source = iterable if isinstance(iterable, ResponseStream) else ResponseStream(iterable)
+        """
+        数据流，可以在写出响应前通过其 map 函数处理数据块
+        """
+        if content_type is None:
+            if isinstance(self.source.peek(), str):
+                content_type = 'text/plain;charset=%s' % encoding
+            else:
+                content_type = 'application/octet-stream'
+        if chunk_size is None:
+            chunk_size = self.CHUNK_SIZE
+        content = self._generate(self.source, chunk_size, encoding)
         super().__init__(content, content_type=content_type, **kwargs)
 
+    @staticmethod
+    def _generate(source: ResponseStream, chunk_size: int, encoding: str):
+        buffer = []
+        size = 0
+        try:
+            for item in source:
+                if isinstance(item, str):
+                    item = item.encode(encoding)
+                if not item:
+                    continue
+                if not chunk_size:
+                    yield item
+                    continue
+                buffer.append(item)
+                size += len(item)
+                if size < chunk_size:
+                    continue
+                yield b''.join(buffer)
+                buffer.clear()
+                size = 0
+            if buffer:
+                yield b''.join(buffer)
+        finally:
+            source.close()
+
 
 class FileResponse(HttpResponse):
+    # 读取文件时，每次读取的最大字节数
+    CHUNK_SIZE = 64 * 1024
+    # 单个请求允许的最大分段数量，超出时忽略 range 并返回完整的文件
+    MAX_RANGES = 16
+
     def __init__(self, fp: Union[str, bytes, IOBase], attachment: [str, bool] = None,
                  content_type=None,
                  ranges: Tuple[int, int] = (),
-                 request=None, **kwargs):
+                 request=None, chunk_size: int = None,
+                 byte_ranges: Union[Tuple[int, Optional[int]], List[Tuple[int, Optional[int]]]] = None, **kwargs):
         """
 
         :param fp: 文件名或内容。如果指定的 fp 是文件名（字符串），那么认为传入的是文件名。
         :param attachment: 指定一个字符串，作为返回附件的文件名，当指定为 True （同时 fp 为文件名）时，将 fp 文件名作为 attachment 的值
         :param content_type: 当未指定此值时，如果指定的 fp 是文件名，那么会自动根据文件的扩展名进行识别
-        :param ranges: 用于指定返回数据的分块起始位置
+        :param ranges: 用于指定返回数据的分块起始位置 (start, end)，不包含 end 位置，end 为 0 时表示仅返回长度，而不返回内容
+        :param request: 请求对象
+        :param chunk_size: 读取文件时，每次读取的最大字节数，为 None 时使用 CHUNK_SIZE
+        :param byte_ranges: 与请求头 Range 含义相同的分块 (start, end)，包含 end 位置，end 为 None 时表示到文件末尾，
+        可以指定多个分块。未指定此值以及 ranges 时，若指定了 request，则根据请求头 Range 和 If-Range 确定
         :param kwargs:
         """
+        file_path = None
         # 如果是字符串，就认为是文件路径
         if isinstance(fp, str):
+            file_path = fp
             if isinstance(attachment, bool) and attachment:
-                from os import path
-                attachment = path.basename(fp)
+                attachment = os.path.basename(fp)
             # 根据文件的扩展名自动识别 mime
             if content_type is None:
                 import mimetypes
@@ -51,75 +189,245 @@ class FileResponse(HttpResponse):
         if content_type is None:
             content_type = 'application/octet-stream'
 
-        # 需要分块返回文件
-        if ranges:
+        # 文件路径，fp 不是文件名时为 None
+        self.file_path = file_path
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        # 返回完整的文件时，在响应时使用 wsgi.file_wrapper 输出
+        self._wrap_file = False
+
+        headers = kwargs.get('headers')
+        if headers is None:
+            headers = {}
+            kwargs['headers'] = headers
+
+        file_size, etag, last_modified = self._get_file_info(file_path)
+        if etag is not None:
+            headers['ETag'] = '"%s"' % etag
+            headers['Last-Modified'] = http_date(last_modified)
+
+            # 文件未变化时，返回 304
+            if request is not None and request.method in ('GET', 'HEAD'):
+                from .conditional import is_modified
+                if not is_modified(request, etag, last_modified):
+                    self.fp.close()
+                    super().__init__(status=304, headers=headers)
+                    return
+
+        seekable = isinstance(self.fp, IOBase) and self.fp.seekable()
+        if seekable and file_size is not None:
+            headers['Accept-Ranges'] = 'bytes'
+
+        if ranges or byte_ranges:
             # fix https://gitee.com/wangankeji/restfx/issues/I3SBXR
             # IOBase for BufferedReader(with open(xxx)) and BytesIO, etc.
-            if not isinstance(self.fp, IOBase):
+            if not seekable:
                 raise TypeError('FileResponse with "ranges" works with type "IOBase" only')
-            if not self._get_file_chunk(ranges, kwargs):
-                super(FileResponse, self).__init__(status=416)
+
+        status_code = 200
+        content = self.fp
+
+        if ranges:
+            start, end = ranges
+            if start >= file_size or end >= file_size:
+                self.fp.close()
+                super().__init__(status=416, headers=headers)
                 return
             status_code = 206
-        else:
+            if end == 0:
+                # 结束为 0 表示仅返回长度，而不返回内容
+                self.fp.close()
+                self.fp = BytesIO()
+                content = self.fp
+                headers['Content-Length'] = str(file_size)
+            else:
+                content = self._read_range(start, end)
+                headers['Content-Length'] = str(end - start)
+            headers['Content-Range'] = 'bytes %s-%s/%s' % (start, end, file_size)
+            ranges = None
+        elif byte_ranges:
+            ranges = self._get_ranges(byte_ranges)
+        elif seekable and file_size is not None and request is not None:
+            ranges = self._get_request_ranges(request, etag, last_modified)
+
+        # 需要分块返回文件
+        if ranges:
+            ranges = self._resolve_ranges(ranges, file_size)
+            if not ranges:
+                self.fp.close()
+                headers['Content-Range'] = 'bytes */%s' % file_size
+                super().__init__(status=416, headers=headers)
+                return
+            status_code = 206
+            if len(ranges) == 1:
+                start, stop = ranges[0]
+                content = self._read_range(start, stop)
+                headers['Content-Length'] = str(stop - start)
+                headers['Content-Range'] = 'bytes %s-%s/%s' % (start, stop - 1, file_size)
+            else:
+                content, content_type = self._read_ranges(ranges, file_size, content_type, headers)
+        elif status_code == 200:
             # fix https://gitee.com/wangankeji/restfx/issues/I3UN41
-            headers = kwargs.get('headers')
-            if headers is None:
-                headers = {}
-                kwargs['headers'] = headers
-            if 'content-length' not in headers:
-                headers['Content-Length'] = str(self._get_file_size())
-            status_code = 200
+            if 'content-length' not in headers and file_size is not None:
+                headers['Content-Length'] = str(file_size)
+            self._wrap_file = True
 
         if attachment:
             self._set_attachment_header(request, attachment, kwargs)
 
-        super().__init__(self.fp, status=status_code, direct_passthrough=True,
+        super().__init__(content, status=status_code, direct_passthrough=True,
                          content_type=content_type, **kwargs)
 
-    def _get_file_size(self):
+    def get_app_iter(self, environ):
+        # 返回完整文件时，优先使用服务器提供的 wsgi.file_wrapper (一般会使用 sendfile 实现零拷贝)
+        # 响应数据被替换 (如被中间件压缩) 后，不再使用 wsgi.file_wrapper
+        if self._wrap_file and self.response is self.fp \
+                and environ['REQUEST_METHOD'] != 'HEAD' and self.status_code == 200:
+            from werkzeug.wsgi import wrap_file
+            return wrap_file(environ, self.fp, self.chunk_size)
+        return super().get_app_iter(environ)
+
+    def _get_file_info(self, file_path: str = None):
+        """
+        获取文件的大小，ETag 以及修改时间，只有在 fp 是一个文件时，才会有 ETag 以及修改时间
+        :param file_path:
+        :return:
+        """
+        file_stat = None
+        # noinspection PyBroadException
+        try:
+            file_stat = os.stat(file_path) if file_path else os.fstat(self.fp.fileno())
+        except Exception:
+            pass
+
+        if file_stat is not None and stat.S_ISREG(file_stat.st_mode):
+            etag = '%x-%x' % (file_stat.st_mtime_ns, file_stat.st_size)
+            return file_stat.st_size, etag, int(file_stat.st_mtime)
+
+        if not isinstance(self.fp, IOBase) or not self.fp.seekable():
+            return None, None, None
+
         pos = self.fp.tell()
         self.fp.seek(0, 2)
         file_size = self.fp.tell()
         self.fp.seek(pos, 0)
 
-        return file_size
+        return file_size, None, None
 
-    def _get_file_chunk(self, ranges: Tuple[int, int], kwargs):
-        from io import BytesIO
-
-        file_size = self._get_file_size()
-
-        start, end = ranges
-
-        if start >= file_size or end >= file_size:
-            return False
+    @staticmethod
+    def _get_ranges(ranges) -> List[Tuple[int, Optional[int]]]:
+        """
+        将指定的分块 (包含 end 位置) 转换成 [start, stop) 的形式
+        :param ranges:
+        :return:
+        """
+        if isinstance(ranges[0], int):
+            ranges = [ranges]
+        return [(start, None if end is None else end + 1) for (start, end) in ranges]
 
-        if end == 0:
-            # 结束为 0 表示仅返回长度，而不返回内容
-            self.fp = BytesIO()
-            chunk_size = file_size
-        else:
-            chunk = BytesIO()
-            # The fetched data size
-            chunk_size = end - start
-            self.fp.seek(start)
-            buffer = self.fp.read(chunk_size)
+    def _get_request_ranges(self, request, etag: Optional[str], last_modified: Optional[int]):
+        """
+        根据请求头 Range 和 If-Range 获取请求的分块
+        :param request:
+        :param etag:
+        :param last_modified:
+        :return: 不需要分块返回时，返回 None
+        """
+        from werkzeug.http import parse_if_range_header, parse_range_header
+
+        request_range = parse_range_header(request.headers.get('Range'))
+        # 无法识别的 Range 会被忽略
+        if request_range is None or request_range.units != 'bytes':
+            return None
+
+        if len(request_range.ranges) > self.MAX_RANGES:
+            return None
+
+        if_range_value = request.headers.get('If-Range')
+        if if_range_value:
+            # If-Range 需要强校验，文件已经变化时返回完整的文件
+            if_range = parse_if_range_header(if_range_value)
+            if if_range.etag is not None:
+                if etag is None or if_range_value.startswith('W/') or if_range.etag != etag:
+                    return None
+            elif if_range.date is not None:
+                if last_modified is None or int(if_range.date.timestamp()) != last_modified:
+                    return None
+            else:
+                return None
+
+        return request_range.ranges
+
+    @staticmethod
+    def _resolve_ranges(ranges, file_size: int) -> List[Tuple[int, int]]:
+        """
+        计算分块在文件中的实际位置 [start, stop)，会忽略超出文件大小的分块
+        :param ranges:
+        :param file_size:
+        :return:
+        """
+        result = []
+        for (start, stop) in ranges:
+            if start < 0:
+                # 后缀分块，如: bytes=-500
+                start = max(file_size + start, 0)
+                stop = file_size
+            elif stop is None or stop > file_size:
+                stop = file_size
+            if start >= stop:
+                continue
+            result.append((start, stop))
+        return result
+
+    def _iter_range(self, start: int, stop: int):
+        fp = self.fp
+        chunk_size = self.chunk_size
+        fp.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = fp.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def _read_range(self, start: int, stop: int):
+        try:
+            yield from self._iter_range(start, stop)
+        finally:
             self.fp.close()
-            chunk.write(buffer)
-            chunk.seek(0)
-            self.fp = chunk
-
-        # set the response headers
-        headers = kwargs.get('headers')
-        if headers is None:
-            headers = {}
-            kwargs['headers'] = headers
 
-        headers['Accept-Ranges'] = 'bytes'
-        headers['Content-Length'] = str(chunk_size)
-        headers['Content-Range'] = 'bytes %s-%s/%s' % (start, end, file_size)
-        return True
+    def _read_ranges(self, ranges: List[Tuple[int, int]], file_size: int, content_type: str, headers):
+        """
+        生成 multipart/byteranges 格式的多个分块
+        :return: 分块数据的生成器，以及响应的 content_type
+        """
+        import uuid
+        boundary = uuid.uuid4().hex
+
+        parts = []
+        content_length = 0
+        for (start, stop) in ranges:
+            part_header = ('--%s\r\nContent-Type: %s\r\nContent-Range: bytes %s-%s/%s\r\n\r\n' % (
+                boundary, content_type, start, stop - 1, file_size
+            )).encode()
+            parts.append((part_header, start, stop))
+            content_length += len(part_header) + (stop - start) + 2
+        end = ('--%s--\r\n' % boundary).encode()
+        content_length += len(end)
+
+        headers['Content-Length'] = str(content_length)
+
+        def generate():
+            try:
+                for (part_header, part_start, part_stop) in parts:
+                    yield part_header
+                    yield from self._iter_range(part_start, part_stop)
+                    yield b'\r\n'
+                yield end
+            finally:
+                self.fp.close()
+
+        return generate(), 'multipart/byteranges; boundary=%s' % boundary
 
     # noinspection PyMethodMayBeStatic
     def _set_attachment_header(self, request, filename, kwargs):
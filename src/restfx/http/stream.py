@@ -0,0 +1,55 @@
+from typing import Callable, Iterable
+
+# a singleton sentinel value for parameter defaults
+_sentinel = object()
+
+
+class ResponseStream:
+    """
+    路由函数返回的数据流 (迭代器/生成器) 的包装
+
+    - 中间件的 process_return 收到的 data 以及流式响应的 source 属性均为此类型
+    - 可以通过 map 函数在不读取数据的情况下，对数据流中的每一项进行处理
+    """
+
+    def __init__(self, iterable: Iterable):
+        self._source = iter(iterable)
+        self._iterator = self._source
+        # 已经预先读取的数据项
+        self._head = []
+
+    def peek(self, default=None):
+        """
+        预先读取第一项数据，但不会将其从流中移除
+        :param default: 流中没有数据时返回的值
+        :return:
+        """
+        if not self._head:
+            item = next(self._iterator, _sentinel)
+            if item is _sentinel:
+                return default
+            self._head.append(item)
+        return self._head[0]
+
+    def map(self, func: Callable):
+        """
+        对数据流中的每一项进行处理，处理会在读取数据时才进行
+        :param func: 处理函数，其接收一个参数：数据项，返回处理后的数据项
+        :return:
+        """
+        self._head = [func(item) for item in self._head]
+        self._iterator = map(func, self._iterator)
+        return self
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close is not None:
+            close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._head:
+            return self._head.pop(0)
+        return next(self._iterator)
@@ -4,6 +4,9 @@ from abc import ABC
 class MiddlewareBase(ABC):
     """
     路由中间件基类
+
+    所有勾子函数都可以声明为 async def 函数，
+    通过 ASGI 运行时在事件循环中执行，通过 WSGI 运行时在进程内共享的后台事件循环中执行 (见 util.aio.run_sync)
     """
 
     def force_run_method(self, method: int):
@@ -1,36 +1,75 @@
+from functools import partial
+
 from . import methods
 from ..http.response import HttpResponse
 from ..util import Logger, utils
+from ..util.aio import is_async_callable, run_steps, run_sync
+from .interface import MiddlewareBase
+
+_BASE_HOOKS = {
+    MiddlewareBase.on_coming,
+    MiddlewareBase.on_leaving,
+    MiddlewareBase.process_request,
+    MiddlewareBase.process_invoke,
+    MiddlewareBase.process_return,
+    MiddlewareBase.process_response,
+}
 
 
 class MiddlewareManager:
     """
     路由中间件管理器
+
+    中间件的勾子函数可以是 async def 函数，其调用过程编写为生成器 (*_steps)，
+    由 util.aio 中的执行器同步或者异步执行。handle_* 函数为对应过程的同步执行版本。
+    同步的勾子函数可能会阻塞 (如等待锁、读写 session 存储)，在 ASGI 下会在线程池中执行
     """
 
     def __init__(self, config):
         self.config = config
         self.logger = Logger.current()
+        # 勾子函数是否为 async def 函数，其键为勾子函数 (未绑定的函数)
+        self._async_hooks = {}
 
     def handle_shutdown(self):
         for middleware in self.config.reversed_middlewares:
             try:
-                middleware.on_shutdown()
+                if is_async_callable(middleware.on_shutdown):
+                    run_sync(middleware.on_shutdown())
+                else:
+                    middleware.on_shutdown()
             except Exception as e:
                 self.logger.error(utils.get_func_info(middleware.on_shutdown), e)
                 raise e
 
+    def _call(self, method, *args, **kwargs):
+        """
+        调用中间件的勾子函数
+        """
+        # 中间件未实现的勾子函数 (MiddlewareBase 中的空函数) 不需要调用
+        func = getattr(method, '__func__', method)
+        if func in _BASE_HOOKS:
+            return None
+        is_async = self._async_hooks.get(func)
+        if is_async is None:
+            is_async = self._async_hooks[func] = is_async_callable(method)
+        try:
+            # 同步的勾子函数作为可能阻塞的调用，避免在 ASGI 下阻塞事件循环
+            return (yield (partial(method, **kwargs) if kwargs else method), args, not is_async)
+        except Exception as e:
+            self.logger.error(utils.get_func_info(method), e)
+            raise e
+
     def handle_coming(self, request):
+        return run_steps(self.coming_steps(request))
+
+    def coming_steps(self, request):
         return_value = None
         for middleware in self.config.middlewares:
             if return_value:
                 if not middleware.force_run_method(methods.handle_coming):
                     continue
-            try:
-                result = middleware.on_coming(request)
-            except Exception as e:
-                self.logger.error(utils.get_func_info(middleware.on_coming), e)
-                raise e
+            result = yield from self._call(middleware.on_coming, request)
             if return_value:
                 continue
             # 返回的值为 None，继续执行下一个中间件
@@ -44,16 +83,15 @@ class MiddlewareManager:
         return return_value
 
     def handle_leaving(self, request, response):
+        return run_steps(self.leaving_steps(request, response))
+
+    def leaving_steps(self, request, response):
         return_value = None
         for middleware in self.config.reversed_middlewares:
             if return_value:
                 if not middleware.force_run_method(methods.handle_leaving):
                     continue
-            try:
-                result = middleware.on_leaving(request, response)
-            except Exception as e:
-                self.logger.error(utils.get_func_info(middleware.on_leaving), e)
-                raise e
+            result = yield from self._call(middleware.on_leaving, request, response)
             if return_value:
                 continue
             # 返回的值为 None，继续执行下一个中间件
@@ -67,16 +105,15 @@ class MiddlewareManager:
         return return_value
 
     def handle_request(self, request, meta):
+        return run_steps(self.request_steps(request, meta))
+
+    def request_steps(self, request, meta):
         return_value = None
         for middleware in self.config.middlewares:
             if return_value:
                 if not middleware.force_run_method(methods.handle_request):
                     continue
-            try:
-                result = middleware.process_request(request, meta)
-            except Exception as e:
-                self.logger.error(utils.get_func_info(middleware.process_request), e)
-                raise e
+            result = yield from self._call(middleware.process_request, request, meta)
             if return_value:
                 continue
             # 返回的值为 None，继续执行下一个中间件
@@ -91,16 +128,15 @@ class MiddlewareManager:
         在路由函数调用前，对其参数等进行处理
         :return:
         """
+        return run_steps(self.invoke_steps(request, meta, args))
+
+    def invoke_steps(self, request, meta, args: dict):
         return_value = None
         for middleware in self.config.middlewares:
             if return_value:
                 if not middleware.force_run_method(methods.before_invoke):
                     continue
-            try:
-                result = middleware.process_invoke(request, meta, args)
-            except Exception as e:
-                self.logger.error(utils.get_func_info(middleware.process_invoke), e)
-                raise e
+            result = yield from self._call(middleware.process_invoke, request, meta, args)
             if return_value:
                 continue
             # 返回的值为 None，继续执行下一个中间件
@@ -115,16 +151,15 @@ class MiddlewareManager:
         在路由函数调用后，对其返回值进行处理
         :return:
         """
+        return run_steps(self.return_steps(request, meta, data))
+
+    def return_steps(self, request, meta, data):
         return_value = None
         for middleware in self.config.reversed_middlewares:
             if return_value:
                 if not middleware.force_run_method(methods.after_return):
                     continue
-            try:
-                result = middleware.process_return(request, meta, data=data)
-            except Exception as e:
-                self.logger.error(utils.get_func_info(middleware.process_return), e)
-                raise e
+            result = yield from self._call(middleware.process_return, request, meta, data=data)
             if return_value:
                 continue
             # 返回的值为 None，继续执行下一个中间件
@@ -143,13 +178,12 @@ class MiddlewareManager:
         在响应前，对响应的数据进行处理
         :return:
         """
+        return run_steps(self.response_steps(request, meta, response))
+
+    def response_steps(self, request, meta, response):
         # 对 response 进行处理
         for middleware in self.config.reversed_middlewares:
-            try:
-                result = middleware.process_response(request, meta, response=response)
-            except Exception as e:
-                self.logger.error(utils.get_func_info(middleware.process_response), e)
-                raise e
+            result = yield from self._call(middleware.process_response, request, meta, response=response)
             # 返回 None，那么继续执行下一个中间件
             if result is None:
                 continue
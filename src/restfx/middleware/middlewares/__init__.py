@@ -1,4 +1,6 @@
 from .auth import HttpAuthMiddleware
+from .cache import ResponseCacheMiddleware, ICacheBackend, MemoryCacheBackend, SqliteCacheBackend
+from .compression import CompressionMiddleware
 from .options import OptionsMiddleware
 from .session import SessionMiddleware
 from .timetick import TimetickMiddleware
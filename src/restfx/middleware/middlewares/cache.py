@@ -0,0 +1,273 @@
+import pickle
+import time
+from abc import ABC, abstractmethod
+from threading import Event, Lock
+from typing import Optional
+
+from ...http import HttpRequest, HttpResponse
+from ...middleware.interface import MiddlewareBase
+from ...session import HttpSession
+from ...util import md5
+from ...util.lru_cache import LRUCache
+
+
+class ICacheBackend(ABC):
+    """
+    响应缓存的存储基类，自定义存储时应该继承此类
+
+    存储的值为 (status, headers, body) 元组
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[tuple]:
+        """
+        获取缓存，缓存不存在或已经过期时返回 None
+        :param key:
+        :return:
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def set(self, key: str, value: tuple, ttl: float):
+        """
+        写入缓存
+        :param key:
+        :param value:
+        :param ttl: 有效时长，单位为秒
+        :return:
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def remove(self, key: str):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def clear(self):
+        raise NotImplementedError()
+
+    def dispose(self):
+        pass
+
+
+class MemoryCacheBackend(ICacheBackend):
+    """
+    基于进程内存的 LRU 缓存，线程安全
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """
+
+        :param maxsize: 最大缓存项数量，超出时移除最久未使用的项
+        """
+        self.cache = LRUCache(maxsize)
+
+    def get(self, key: str) -> Optional[tuple]:
+        item = self.cache.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires < time.monotonic():
+            self.cache.remove(key)
+            return None
+        return value
+
+    def set(self, key: str, value: tuple, ttl: float):
+        self.cache.set(key, (value, time.monotonic() + ttl))
+
+    def remove(self, key: str):
+        self.cache.remove(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class SqliteCacheBackend(ICacheBackend):
+    """
+    基于 sqlite 的缓存，指定数据库文件时，可以在多个进程间共享
+    """
+
+    def __init__(self, database: str = ':memory:', table_name='restfx_response_cache', timeout=5):
+        """
+
+        :param database: 数据库文件，指定为 ``:memory:`` 表示使用内存数据库 (不能在进程间共享)
+        :param table_name:
+        :param timeout: 数据库被锁定时，等待的时长，单位为秒
+        """
+        import sqlite3
+        self.table_name = table_name
+        self.lock = Lock()
+        self.conn = sqlite3.connect(database, timeout=timeout, check_same_thread=False)
+        with self.lock:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS `{table_name}` ('
+                '`key` VARCHAR(32) PRIMARY KEY NOT NULL, `expires` REAL NOT NULL, `value` BLOB)'.format(
+                    table_name=table_name))
+            self.conn.commit()
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT `value` FROM `{table_name}` WHERE `key`=? AND `expires`>? LIMIT 1'.format(
+                    table_name=self.table_name), (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key: str, value: tuple, ttl: float):
+        now = time.time()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.conn.execute('DELETE FROM `{table_name}` WHERE `expires`<=?'.format(table_name=self.table_name),
+                              (now,))
+            self.conn.execute('INSERT OR REPLACE INTO `{table_name}` VALUES(?, ?, ?)'.format(
+                table_name=self.table_name), (key, now + ttl, data))
+            self.conn.commit()
+
+    def remove(self, key: str):
+        with self.lock:
+            self.conn.execute('DELETE FROM `{table_name}` WHERE `key`=?'.format(table_name=self.table_name), (key,))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM `{table_name}`'.format(table_name=self.table_name))
+            self.conn.commit()
+
+    def dispose(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ResponseCacheMiddleware(MiddlewareBase):
+    """
+    缓存路由的响应
+
+    路由通过装饰器参数启用缓存:
+    @route('模块', '名称', cache_ttl=60, cache_vary=('arg1', 'header:Accept'))
+
+    - cache_ttl: 缓存的有效时长，单位为秒
+    - cache_vary: 参与生成缓存键的项，为 None 时使用所有的路由参数。
+      项的格式为: 参数名称, header:请求头名称, cookie:cookie 名称
+
+    缓存键由 method, path 以及 cache_vary 指定的项生成。只会缓存 GET/HEAD 请求的 200 响应，流式响应不会被缓存。
+    同一个缓存键在同一时间只会有一个请求调用路由函数，其它请求会等待其结果 (防止缓存击穿)
+    """
+
+    KEY = '__response_cache__'
+    HEADER = 'restfx-cache'
+
+    def __init__(self, backend: ICacheBackend = None, wait_timeout: float = 10):
+        """
+
+        :param backend: 缓存存储，为 None 时使用 MemoryCacheBackend
+        :param wait_timeout: 等待其它请求生成缓存的最长时间，单位为秒，超时后会自行调用路由函数
+        """
+        self.backend = MemoryCacheBackend() if backend is None else backend
+        self.wait_timeout = wait_timeout
+        # 正在生成缓存的键
+        self._flights = {}
+        """
+        :type: Dict[str, Event]
+        """
+        self._flights_lock = Lock()
+
+    @staticmethod
+    def get_key(request, meta, args: dict) -> str:
+        """
+        生成缓存键
+        :param request:
+        :param meta:
+        :param args: 路由函数的实际参数
+        :return:
+        """
+        vary = meta.get('cache_vary')
+        if vary is None:
+            items = [
+                (name, value)
+                for name, value in sorted(args.items())
+                # 不使用注入参数以及请求/session 对象
+                if not name.startswith('_') and not isinstance(value, (HttpRequest, HttpSession))
+            ]
+        else:
+            if isinstance(vary, str):
+                vary = (vary,)
+            items = []
+            for item in vary:
+                if item.startswith('header:'):
+                    items.append((item, request.headers.get(item[7:])))
+                elif item.startswith('cookie:'):
+                    items.append((item, request.cookies.get(item[7:])))
+                else:
+                    items.append((item, args.get(item)))
+
+        return md5.hash_str(repr((request.method, request.path, items)))
+
+    def process_invoke(self, request, meta, args: dict):
+        ttl = meta.get('cache_ttl')
+        if not ttl or request.method not in ('GET', 'HEAD'):
+            return
+
+        key = self.get_key(request, meta, args)
+        response = self._get_response(key)
+        if response is not None:
+            return response
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                # 由当前请求生成缓存
+                self._flights[key] = Event()
+                request.set(self.KEY, (key, ttl))
+                return
+
+        # 等待其它请求生成缓存
+        flight.wait(self.wait_timeout)
+        return self._get_response(key)
+
+    def process_response(self, request, meta, response):
+        state = request.get(self.KEY)
+        if state is None:
+            return
+
+        key, ttl = state
+        try:
+            if response.status_code == 200 and not response.is_streamed and not response.direct_passthrough:
+                headers = [
+                    (name, value)
+                    for (name, value) in response.headers.items()
+                    if name.lower() not in ('set-cookie', 'content-length')
+                ]
+                self.backend.set(key, (response.status_code, headers, response.get_data()), ttl)
+        finally:
+            self._release(request)
+
+    def on_leaving(self, request, response):
+        # 路由调用过程中出现异常时，不会调用 process_response
+        self._release(request)
+
+    def on_shutdown(self):
+        self.backend.dispose()
+
+    def _get_response(self, key: str) -> Optional[HttpResponse]:
+        cached = self.backend.get(key)
+        if cached is None:
+            return None
+        status, headers, body = cached
+        content_type = None
+        for (name, value) in headers:
+            if name.lower() == 'content-type':
+                content_type = value
+                break
+        response = HttpResponse(body, status=status, headers=headers, content_type=content_type)
+        response.headers[self.HEADER] = 'hit'
+        return response
+
+    def _release(self, request):
+        if request is None or request.get(self.KEY) is None:
+            return
+        key, _ = request.remove(self.KEY)
+        with self._flights_lock:
+            flight = self._flights.pop(key, None)
+        if flight is not None:
+            flight.set()
@@ -0,0 +1,230 @@
+import os
+import zlib
+from typing import Optional, Tuple
+
+from ...http import FileResponse
+from ...middleware.interface import MiddlewareBase
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        # wbits=31 表示使用 gzip 格式
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, level: int):
+        import brotli
+        # brotli 的压缩级别范围为 0-11
+        self.compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class _ZstdCompressor:
+    def __init__(self, level: int):
+        import zstandard
+        self.module = zstandard
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(self.module.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+def _is_available(module_name: str) -> bool:
+    import importlib.util
+    return importlib.util.find_spec(module_name) is not None
+
+
+class CompressionMiddleware(MiddlewareBase):
+    """
+    根据请求头 Accept-Encoding 压缩响应数据，支持 br, zstd (需要另行安装 brotli/zstandard) 和 gzip
+
+    - 只会压缩可压缩的内容类型 (文本、json、js 等)，并跳过小于 min_size 的响应
+    - 流式响应会边读取边压缩，每个数据块都会立即写出
+    - 返回文件时，如果存在预先压缩的文件 (如 app.js.br, app.js.gz)，会直接返回预先压缩的文件
+    """
+
+    # 编码与其实现
+    COMPRESSORS = {
+        'br': _BrotliCompressor,
+        'zstd': _ZstdCompressor,
+        'gzip': _GzipCompressor,
+    }
+
+    # 编码对应的预先压缩文件的扩展名
+    SIDECAR_EXTENSIONS = {
+        'br': '.br',
+        'zstd': '.zst',
+        'gzip': '.gz',
+    }
+
+    # 可压缩的内容类型，以 / 结尾的表示类型前缀
+    COMPRESSIBLE_TYPES = (
+        'text/',
+        'application/json',
+        'application/javascript',
+        'application/x-javascript',
+        'application/xml',
+        'application/xhtml+xml',
+        'application/markdown',
+        'image/svg+xml',
+    )
+
+    def __init__(self, min_size: int = 1024, level: int = 6, encodings: Tuple[str, ...] = None,
+                 compressible_types: Tuple[str, ...] = None, precompressed=True):
+        """
+
+        :param min_size: 响应数据小于此大小 (字节) 时不压缩
+        :param level: 压缩级别
+        :param encodings: 支持的编码，按优先级排列，为 None 时使用所有可用的编码 (br, zstd, gzip)
+        :param compressible_types: 可压缩的内容类型，为 None 时使用 COMPRESSIBLE_TYPES
+        :param precompressed: 返回文件时，是否查找预先压缩的文件
+        """
+        self.min_size = min_size
+        self.level = level
+        if encodings is None:
+            encodings = tuple(
+                encoding
+                for encoding, module_name in (('br', 'brotli'), ('zstd', 'zstandard'), ('gzip', 'zlib'))
+                if _is_available(module_name)
+            )
+        self.encodings = encodings
+        self.compressible_types = self.COMPRESSIBLE_TYPES if compressible_types is None else compressible_types
+        self.precompressed = precompressed
+
+    def is_compressible(self, mimetype: Optional[str]) -> bool:
+        if not mimetype:
+            return False
+        if mimetype.endswith('+json') or mimetype.endswith('+xml'):
+            return True
+        for item in self.compressible_types:
+            if mimetype == item or (item.endswith('/') and mimetype.startswith(item)):
+                return True
+        return False
+
+    def on_leaving(self, request, response):
+        if request is None or response is None or request.method == 'HEAD':
+            return
+
+        # 仅处理完整的响应，分块响应 (206) 不压缩
+        if response.status_code != 200 or 'Content-Encoding' in response.headers:
+            return
+
+        cache_control = response.headers.get('Cache-Control')
+        if cache_control and 'no-transform' in cache_control:
+            return
+
+        if not self.is_compressible(response.mimetype):
+            return
+
+        # 无论是否压缩，缓存都需要区分 Accept-Encoding
+        response.vary.add('Accept-Encoding')
+
+        if isinstance(response, FileResponse) and self.precompressed and self._use_sidecar(request, response):
+            return
+
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if not encoding:
+            return
+
+        if response.is_streamed or response.direct_passthrough:
+            content_length = response.headers.get('Content-Length')
+            if content_length is not None and int(content_length) < self.min_size:
+                return
+            source = response.response
+            if isinstance(response, FileResponse):
+                from werkzeug.wsgi import FileWrapper
+                body = FileWrapper(response.fp, response.chunk_size)
+                # 文件不需要在每个数据块后立即写出
+                flush = False
+            else:
+                body = response.iter_encoded()
+                flush = True
+            response.response = self._compress_iter(source, body, encoding, flush)
+            response.direct_passthrough = True
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return
+            compressor = self.COMPRESSORS[encoding](self.level)
+            response.set_data(compressor.compress(data) + compressor.finish())
+
+        response.headers['Content-Encoding'] = encoding
+        self._weaken_etag(response)
+
+    def _use_sidecar(self, request, response: FileResponse) -> bool:
+        """
+        使用预先压缩的文件作为响应
+        :return: 找到了预先压缩的文件时返回 True
+        """
+        if not response.file_path:
+            return False
+
+        sidecars = [
+            encoding
+            for encoding in self.SIDECAR_EXTENSIONS
+            if os.path.isfile(response.file_path + self.SIDECAR_EXTENSIONS[encoding])
+        ]
+        if not sidecars:
+            return False
+
+        encoding = request.accept_encodings.best_match(sidecars)
+        if not encoding:
+            return False
+
+        response.close()
+        fp = open(response.file_path + self.SIDECAR_EXTENSIONS[encoding], mode='rb')
+        response.fp = fp
+        response.response = fp
+        response.headers['Content-Length'] = str(os.fstat(fp.fileno()).st_size)
+        response.headers['Content-Encoding'] = encoding
+        self._weaken_etag(response)
+        return True
+
+    @staticmethod
+    def _weaken_etag(response):
+        # 压缩后的数据与原数据在语义上等价，使用弱 ETag 以保持条件请求 (304) 可用
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+
+    def _compress_iter(self, source, body, encoding: str, flush: bool):
+        compressor = self.COMPRESSORS[encoding](self.level)
+        try:
+            for chunk in body:
+                if not chunk:
+                    continue
+                data = compressor.compress(chunk)
+                if flush:
+                    data += compressor.flush()
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            close = getattr(source, 'close', None)
+            if close is not None:
+                close()
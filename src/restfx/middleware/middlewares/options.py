@@ -87,10 +87,14 @@ class OptionsMiddleware(MiddlewareBase):
         if app.config.debug:
             # 调试模式时，从源码查找可用的路由
             entry = entry.lstrip('/')
+            if not app.router.route_table.compiled:
+                app.router.compile_routes()
             resolver = RouteResolver(
                 app.config,
                 app.router.entry_cache,
-                request.method, entry
+                request.method, entry,
+                app.router.route_table,
+                app.router.missing_cache
             )
 
             # 分别尝试不同 method 的路由是否存在
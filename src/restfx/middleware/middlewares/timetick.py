@@ -37,6 +37,9 @@ class TimetickMiddleware(MiddlewareBase):
 
     def on_leaving(self, request, response):
         timetick = request.get(self.KEY)
+        # 静态资源请求不会调用 on_coming
+        if timetick is None:
+            return
         timetick.append(self._get_timetick())
 
         total = round(timetick[-1] - timetick[0], 3)
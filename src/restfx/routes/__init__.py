@@ -2,3 +2,4 @@ from .api_page import ApiPage
 from .collector import Collector
 from .meta import RouteMeta
 from .router import Router
+from .static import StaticFiles
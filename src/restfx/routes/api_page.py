@@ -2,6 +2,7 @@ import os
 
 from ..config import AppConfig
 from ..http import BadRequest, HttpResponse, JsonResponse, NotFound
+from ..http.conditional import make_conditional
 from ..util import utils
 from ..util.func_util import FunctionDescription
 
@@ -54,14 +55,14 @@ class ApiPage:
                 ]
                 self.api_page_html_cache = ''.join(lines)
                 fp.close()
-        return HttpResponse(self.api_page_html_cache, content_type='text/html')
+        return make_conditional(request, HttpResponse(self.api_page_html_cache, content_type='text/html'))
 
     def return_api_info(self, request):
         if not self.routes_cache or not self.config.api_page_cache:
             self.routes_cache = self.config.docs
 
         from .. import __meta__
-        return JsonResponse({
+        return make_conditional(request, JsonResponse({
             'api_version': __meta__.api_version,
             'meta': {
                 'name': __meta__.name,
@@ -76,7 +77,7 @@ class ApiPage:
                 for item in self.config.enum_types
             ],
             'custom_assets': self.config.api_page_assets
-        }, encoder=FunctionDescription.JSONEncoder, ensure_ascii=request.GET.get('ascii') == 'true')
+        }, encoder=FunctionDescription.JSONEncoder, ensure_ascii=request.GET.get('ascii') == 'true'))
 
     def do_export(self, request):
         if request.method != 'POST':
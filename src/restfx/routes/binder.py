@@ -0,0 +1,458 @@
+from collections import OrderedDict
+from collections.abc import Mapping
+from enum import Enum
+from types import FunctionType
+
+from .parameter_interface import IParam
+from ..config import AppConfig
+from ..http import BadRequest, HttpRequest, HttpResponse, ServerError
+from ..session import HttpSession
+from ..util import Logger, serializer
+from ..util.func_util import ArgumentSpecification, get_func_info
+
+# 参数的种类
+_KIND_VALUE = 0
+_KIND_REQUEST = 1
+_KIND_SESSION = 2
+
+
+def _get_parameter_str(args_def: OrderedDict):
+    return ', '.join(filter(lambda n: n[0] != '_', [str(args_def[arg]) for arg in args_def]))
+
+
+def _has_body(request) -> bool:
+    """
+    请求是否带有请求体
+    :param request:
+    :return:
+    """
+    environ = request.environ
+    if environ.get('HTTP_TRANSFER_ENCODING'):
+        return True
+    content_length = environ.get('CONTENT_LENGTH')
+    return bool(content_length) and content_length != '0'
+
+
+def _get_body_attr(request, name: str):
+    # 请求没有请求体时不需要解析，但是中间件可能已经设置了此属性 (如在 on_coming 中设置 request.BODY)
+    if name not in request.__dict__ and not _has_body(request):
+        return None
+    return getattr(request, name)
+
+
+def _get_files(request):
+    files = _get_body_attr(request, 'FILES')
+    return files if isinstance(files, dict) else None
+
+
+def _get_body(request):
+    body = _get_body_attr(request, 'BODY')
+    return body if isinstance(body, dict) else None
+
+
+def _get_form(request):
+    return _get_body_attr(request, 'POST')
+
+
+def _get_query(request):
+    return request.GET
+
+
+class ArgumentSource(Mapping):
+    """
+    请求参数的只读视图，按以下优先级（从高到低）查找参数，不会复制或合并各来源的数据:
+
+    FILES > BODY (json) > POST > GET
+
+    每个来源在首次被查找时才会读取，已经在高优先级来源中找到的参数，不会再读取低优先级的来源；
+    请求没有请求体时，直接跳过 FILES, BODY 以及 POST
+    """
+
+    # 按优先级从高到低排列的参数来源
+    _LAYERS = (_get_files, _get_body, _get_form, _get_query)
+
+    __slots__ = ('request', '_layers')
+
+    def __init__(self, request: HttpRequest):
+        self.request = request
+        # 已经读取的来源，值为 None 表示此来源没有参数
+        self._layers = []
+
+    def _get_layer(self, index: int):
+        layers = self._layers
+        while len(layers) <= index:
+            layers.append(self._LAYERS[len(layers)](self.request))
+        return layers[index]
+
+    def __contains__(self, key):
+        for index in range(len(self._LAYERS)):
+            layer = self._get_layer(index)
+            if layer and key in layer:
+                return True
+        return False
+
+    def __getitem__(self, key):
+        for index in range(len(self._LAYERS)):
+            layer = self._get_layer(index)
+            if layer and key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        # 与按 GET, POST, BODY, FILES 顺序合并参数时的顺序一致
+        seen = set()
+        for index in reversed(range(len(self._LAYERS))):
+            layer = self._get_layer(index)
+            if not layer:
+                continue
+            for key in layer:
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _bad_request(msg: str):
+    Logger.current().warning(msg)
+    return BadRequest(msg)
+
+
+def _make_converter(arg_spec: ArgumentSpecification, arg_name: str):
+    """
+    根据参数的类型声明生成类型转换函数
+    :param arg_spec:
+    :param arg_name:
+    :return: 转换函数，转换失败时返回 HttpResponse
+    """
+    # 未指定类型
+    if not arg_spec.has_annotation:
+        return None
+
+    annotation = arg_spec.annotation
+    annotation_name = arg_spec.annotation_name
+
+    def cannot_parse(arg_value):
+        return _bad_request('Cannot parse value "%s" as type "%s" for parameter "%s".' % (
+            arg_value, annotation_name, arg_name
+        ))
+
+    # 声明的类型为 IParam，调用  parse 进行转换
+    if arg_spec.is_type(IParam):
+        def convert_param(arg_value):
+            # 当值为 None 时，不作数据类型校验
+            if arg_value is None:
+                return arg_value
+            try:
+                return annotation.parse(arg_value)
+            except Exception as ex:
+                return _bad_request('Cannot parse value "%s" as type "%s" for parameter "%s": %s' % (
+                    arg_value, annotation_name, arg_name, str(ex)
+                ))
+
+        return convert_param
+
+    is_tuple = arg_spec.is_tuple
+    is_json = annotation in (dict, list)
+    json_loads = serializer.current().loads
+
+    def convert_value(arg_value):
+        # 转换失败时，会抛出异常
+        # noinspection PyBroadException
+        try:
+            # 当 arg_value 是字符串，arg_spec的类型是对象时，尝试解析成 json
+            if is_json and isinstance(arg_value, str):
+                # noinspection PyBroadException
+                try:
+                    arg_value = json_loads(arg_value)
+                except Exception:
+                    # 此处的异常直接忽略即可
+                    return cannot_parse(arg_value)
+
+            # 类型一致，直接使用
+            if isinstance(arg_value, annotation):
+                # 如果原始声明是 tuple 类型，那么把 list 转换成 tuple
+                # 虽然在发起请求的时候并不能指定为 tuple，但还是想兼容一下
+                return tuple(arg_value) if is_tuple else arg_value
+            return annotation(arg_value)
+        except Exception:
+            return cannot_parse(arg_value)
+
+    # 当声明的参数类型是布尔类型时，收到的值可能是一个字符串（其值为 true 、 false）
+    if annotation is bool:
+        def convert_bool(arg_value):
+            if arg_value is None or isinstance(arg_value, bool):
+                return arg_value
+            if not isinstance(arg_value, str):
+                return convert_value(arg_value)
+            if arg_value == 'true':
+                return True
+            if arg_value == 'false':
+                return False
+            return _bad_request('Cannot parse value "%s" as type "%s for parameter %s". (expected: true/false)' % (
+                arg_value, annotation_name, arg_name
+            ))
+
+        return convert_bool
+
+    # 当声明的参数类型是枚举类型时，遍历枚举项，同时将枚举名称与值进行处理
+    if arg_spec.is_type(Enum):
+        # 此处的判断，始终忽略大小写
+        # 先判断值，再判断名称，先声明的项优先
+        enum_items = {}
+        for enum_item in annotation:
+            enum_items.setdefault(str(enum_item.value).lower(), enum_item)
+            enum_items.setdefault(str(enum_item.name).lower(), enum_item)
+
+        def convert_enum(arg_value):
+            if arg_value is None or isinstance(arg_value, annotation):
+                return arg_value
+            result = enum_items.get(str(arg_value).lower())
+            if result is None:
+                return cannot_parse(arg_value)
+            return result
+
+        return convert_enum
+
+    def convert(arg_value):
+        # 当值为 None 时，不作数据类型校验
+        if arg_value is None:
+            return arg_value
+
+        # 类型一致，直接使用
+        if isinstance(arg_value, annotation):
+            return arg_value
+
+        # 类型不一致，尝试转换类型
+        if annotation is list and isinstance(arg_value, tuple):
+            return list(arg_value)
+
+        return convert_value(arg_value)
+
+    return convert
+
+
+def _make_getter(arg_spec: ArgumentSpecification, arg_name: str):
+    """
+    根据参数声明生成取值函数
+    :param arg_spec:
+    :param arg_name:
+    :return: 取值函数，参数缺失或者转换失败时返回 HttpResponse
+    """
+    # 要查找的参数名称，及其值是否为数组
+    # 提供对 a[]=1&a[]=2 的支持
+    keys = [(arg_name, False)]
+    if arg_spec.alias:
+        for an in arg_spec.alias:
+            keys.append((an, False))
+            keys.append((an + '[]', True))
+    else:
+        keys.append((arg_name + '[]', True))
+    keys = tuple(keys)
+
+    has_default = arg_spec.has_default
+    default = arg_spec.default
+    # 特别地，针对枚举类型，传入空时使用默认值
+    is_enum = arg_spec.is_type(Enum)
+    convert = _make_converter(arg_spec, arg_name)
+
+    def getter(data):
+        for (key, is_arr) in keys:
+            if key in data:
+                value = data.get(key)
+                break
+        else:
+            if has_default or is_enum:
+                # 使用默认值
+                return default
+            # 缺少无默认值的参数
+            return _bad_request('Missing required argument "%s".' % arg_name)
+
+        if is_enum:
+            temp = value[-1] if isinstance(value, list) else value
+            if temp is None or temp == '':
+                return default
+
+        if is_arr:
+            # 请求参数本就为数组: param[]
+            # 返回为 tuple 类型
+            value = tuple(value)
+
+        return value if convert is None else convert(value)
+
+    return getter
+
+
+class ArgumentBinder:
+    """
+    路由函数的参数绑定器。
+
+    根据路由函数的参数声明，预先为每个参数生成取值与类型转换函数，
+    处理请求时按顺序调用即可，不再需要对参数类型进行判断
+    """
+
+    def __init__(self, func: FunctionType, args_def: OrderedDict):
+        """
+
+        :param func: 路由函数
+        :param args_def: 路由函数的参数声明
+        """
+        self.func = func
+        self.args_def = args_def
+        self.binders = []
+        """
+        :type: List[Tuple[str, int, FunctionType]]
+        """
+        # 声明的注入参数集合
+        self.injection_args = []
+        # 已使用的参数名称，用于后期填充可变参数时作排除用
+        self.used_args = set()
+        # 是否声明了可变参数
+        self.has_variable_args = False
+
+        for arg_name, arg_spec in args_def.items():
+            if arg_spec.is_injection:
+                self.injection_args.append(arg_name)
+                self.used_args.add(arg_name)
+                continue
+
+            # 如果是可变参数：如: **kwargs
+            # 设置标记，以在后面进行填充
+            if arg_spec.is_variable:
+                self.has_variable_args = True
+                continue
+
+            # 以下情况将传入 HttpRequest 对象
+            # 1. 当参数名称是 request 并且未指定类型
+            # 2. 当参数类型是 HttpRequest 时 (不论参数名称，包括 request)
+            # 但是，参数名称是 request 但其类型不是 HttpRequest ，就会被当作一般参数处理
+            if (arg_name == 'request' and not arg_spec.has_annotation) or arg_spec.annotation == HttpRequest:
+                self.binders.append((arg_name, _KIND_REQUEST, None))
+                continue
+
+            getter = _make_getter(arg_spec, arg_name)
+
+            # 以下情况将传入 HttpSession 对象
+            # 1. 当参数名称是 session 并且未指定类型
+            # 2. 当参数类型是 HttpSession 时 (不论参数名称，包括 session)
+            # 但是，参数名称是 session 但其类型不是 HttpSession ，就会被当作一般参数处理
+            if (arg_name == 'session' and not arg_spec.has_annotation) or arg_spec.annotation == HttpSession:
+                self.binders.append((arg_name, _KIND_SESSION, getter))
+                continue
+
+            self.binders.append((arg_name, _KIND_VALUE, getter))
+            self.used_args.add(arg_name)
+
+    def bind(self, request: HttpRequest, config: AppConfig) -> dict or HttpResponse:
+        """
+        从请求中获取路由函数的实际参数
+        :param request:
+        :param config:
+        :return: 参数集合，出错时返回 HttpResponse
+        """
+        actual_args = {}
+        used_args = self.used_args
+
+        arg_source = ArgumentSource(request)
+
+        for (arg_name, kind, getter) in self.binders:
+            if kind == _KIND_REQUEST:
+                actual_args[arg_name] = request
+                continue
+
+            if kind == _KIND_SESSION:
+                if request.session:
+                    actual_args[arg_name] = request.session
+                    continue
+                self._warn_session(arg_name)
+                # 在 session 未启用时，当作一般参数处理
+                used_args = used_args | {arg_name}
+
+            val = getter(arg_source)
+            if isinstance(val, HttpResponse):
+                return val
+            actual_args[arg_name] = val
+
+        if self.injection_args:
+            result = self._fill_injections(request, actual_args, config)
+            if isinstance(result, HttpResponse):
+                return result
+
+        # 既不接收可变参数，也不需要检查未知参数时，不必遍历所有参数来源
+        if not self.has_variable_args and config.strict_mode is not True:
+            return actual_args
+
+        variable_args = self._get_variable_args(arg_source, used_args)
+
+        # 没有可变参数
+        if not variable_args:
+            return actual_args
+
+        # 有可变参数，并且指定了 kwargs
+        if self.has_variable_args:
+            actual_args.update(variable_args)
+            return actual_args
+
+        # 有可变参数，并且未指定 kwargs
+        # 启用了严格模式
+        # 返回 400 响应
+        variable_arg_keys = variable_args.keys()
+        msg = 'Unknown argument(s) found: "%s", Parameters: (%s).' \
+              % (','.join(variable_arg_keys), _get_parameter_str(self.args_def))
+        Logger.current().warning(msg)
+        if not config.debug:
+            msg = 'Unknown argument(s) found: %s.' % ','.join(variable_arg_keys)
+        return BadRequest(msg)
+
+    def _warn_session(self, arg_name):
+        msg = '%s\n\tParameter "%s" of type "HttpSession" is not available, ' \
+              'the value will always be "None", ' \
+              'please make sure that you have registered the Session-Middleware correctly, ' \
+              'Parameters: (%s)' % (
+                  get_func_info(self.func),
+                  arg_name,
+                  _get_parameter_str(self.args_def)
+              )
+        Logger.current().warning(msg)
+
+    def _fill_injections(self, request, actual_args, config):
+        # 填充注入参数
+        for arg_name in self.injection_args:
+            # 注入名称不包含前缀 _
+            # 所以要 [1:]
+            injection_name = arg_name[1:]
+            # noinspection PyProtectedMember
+            if injection_name in request._injections:
+                # noinspection PyProtectedMember
+                actual_args[arg_name] = request._injections[injection_name]
+                continue
+
+            if injection_name in config.injections:
+                actual_args[arg_name] = config.injections[injection_name]
+                continue
+
+            msg = 'Injection name "%s" not found.' % injection_name
+            if config.debug:
+                msg = '%s\n\t%s' % (get_func_info(self.func), msg)
+            Logger.current().error(msg)
+            return ServerError(msg) if config.debug else ServerError()
+        return None
+
+    @staticmethod
+    def _get_variable_args(arg_source, used_args):
+        # 填充可变参数
+        variable_args = {}
+        for item in arg_source:
+            if item in used_args:
+                continue
+            value = arg_source.get(item)
+            # 当值长度大于1时，使用 tuple
+            # 或者 item 以 [] 结尾
+            if item.endswith('[]'):
+                variable_args[item[:-2]] = tuple(value)
+                continue
+            variable_args[item] = value
+
+        return variable_args
@@ -8,10 +8,11 @@ import keyword
 import os
 import re
 from os import path
+from typing import Union
 
 from ..http import HttpRequest
 from ..session import HttpSession
-from ..util import utils
+from ..util import b64, md5, utils
 from ..util.func_util import FunctionDescription
 
 # 生成：注册路由的代码 -- 模板
@@ -49,6 +50,9 @@ class Collector:
         self.app_root = app_root
         self.append_slash = append_slash
         self.global_types = {}
+        # 文件解析缓存，其键为文件的完整路径，值为 (mtime_ns, size, {函数名称: 装饰器信息})
+        # 文件未变化时，不再重复读取和解析
+        self._parse_cache = {}
 
     @classmethod
     def create(cls, app_id: str, app_root: str, append_slash: bool):
@@ -56,14 +60,64 @@ class Collector:
         cls._COLLECTORS[app_id] = collector
         return collector
 
-    def collect(self, routes_map: dict):
+    def collect(self, routes_map: dict, workers: int = None):
         """
         执行收集操作
+        :param routes_map:
+        :param workers: 并行收集时使用的线程数量，不指定或指定为 1 时串行收集。
+        并行时，文件的解析和函数描述的生成在线程池中执行，模块仍按文件顺序在当前线程中导入，结果顺序与串行收集一致
         :return: 所有路由的集合
         """
+        return self._collect_entries(self._find_entries(routes_map), workers)
+
+    def _collect_entries(self, entries: list, workers: int = None):
+        """
+        解析指定的路由文件
+        :param entries: [(route_root, fullname, http_prefix, pkg_prefix)]
+        :param workers:
+        :return:
+        """
         # 所有路由的集合
         routes = []
 
+        if not entries:
+            return routes
+
+        if not workers or workers <= 1:
+            for entry in entries:
+                # 解析文件
+                self.get_route_defines(*entry, routes)
+            return routes
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='restfx-collector') as pool:
+            # 先并行解析所有文件，解析结果会写入缓存
+            for _ in pool.map(self._get_file_decorators, [entry[1] for entry in entries]):
+                pass
+
+            # 模块导入存在依赖关系，按文件顺序依次导入
+            for entry in entries:
+                for define in self.resolve_file(*entry, describe=False):
+                    if define is None:
+                        continue
+                    routes.append(define)
+
+            # 并行生成函数描述
+            descriptions = pool.map(self._describe_route, routes)
+            for (route, handler_info) in zip(routes, descriptions):
+                route['handler_info'] = handler_info
+
+        return routes
+
+    def _find_entries(self, routes_map: dict) -> list:
+        """
+        查找所有需要解析的路由文件
+        :param routes_map:
+        :return: [(route_root, fullname, http_prefix, pkg_prefix)]
+        """
+        entries = []
+
         if not routes_map:
             raise Exception(
                 'Routes map is empty, did you forgot to call "restfx.map_routes(routes_map: dict)"')
@@ -94,10 +148,14 @@ class Collector:
                     # 可能是 __init__.py
                     fullname = path.abspath(path.join(current_path, file))
 
-                    # 解析文件
-                    self.get_route_defines(route_root, fullname, http_prefix, pkg_prefix, routes)
+                    entries.append((route_root, fullname, http_prefix, pkg_prefix))
 
-        return routes
+        return entries
+
+    @staticmethod
+    def _describe_route(route: dict):
+        handler_obj = getattr(utils.load_module(route['pkg']), route['handler'])
+        return FunctionDescription(handler_obj)
 
     def get_route_defines(self, route_root, fullname, http_prefix, pkg_prefix, routes):
         for define in self.resolve_file(route_root, fullname, http_prefix, pkg_prefix):
@@ -106,13 +164,14 @@ class Collector:
                 continue
             routes.append(define)
 
-    def resolve_file(self, route_define, fullname, http_prefix, pkg_prefix):
+    def resolve_file(self, route_define, fullname, http_prefix, pkg_prefix, describe=True):
         """
         解析文件
         :param pkg_prefix:
         :param http_prefix: http 请求前缀
         :param route_define: 路由文件的根路径
         :param fullname: 文件的完整路径
+        :param describe: 是否生成路由函数的描述，为 False 时 handler_info 为 None
         :return: 没有路由时返回 None
         """
         # 解析路由的定义
@@ -178,7 +237,7 @@ class Collector:
                 Logger.current().error(msg, e)
                 raise e
             handler_obj = getattr(module, func_name)
-            handler_info = FunctionDescription(handler_obj)
+            handler_info = FunctionDescription(handler_obj) if describe else None
 
             # 唯一标识
             router_info['id'] = '%s_%s' % (pkg.replace('_', '__').replace('.', '_'), func_name)
@@ -207,100 +266,280 @@ class Collector:
                 routes_map: dict,
                 routes_filename: str = 'routes_map.py',
                 dirname: str = 'dist',
-                encoding: str = 'utf8'):
+                encoding: str = 'utf8',
+                workers: int = None,
+                incremental: bool = False,
+                bundle: bool = False,
+                lazy: bool = False):
         """
         将路由持久化
         :param routes_map:
         :param routes_filename:
         :param dirname:
         :param encoding:
+        :param workers: 并行收集时使用的线程数量
+        :param incremental: 是否增量生成。启用时，会在输出文件旁存储一个清单文件 (<routes_filename>.manifest.json)，
+        记录每个源文件的内容摘要及其生成的代码，之后仅重新处理内容发生变化的文件
+        :param bundle: 是否同时生成预编译的路由包 (与路由文件同名，扩展名为 .bundle)，
+        其中包含预先生成的参数描述和接口文档，可通过 App.register_bundle 加载
+        :param lazy: 是否生成延迟加载的路由文件。启用时，路由文件不再导入路由函数，
+        而是以 "模块:函数名称" 的形式引用，路由函数所在模块在首次请求时才会导入
         :return: 持久化的 python 代码和接口数据
         """
         imports = []
         routes = []
+        bundle_records = []
 
         from ..config import AppConfig
         addition_func = AppConfig.current().api_page_addition
 
-        print('Generating routes map...')
-        for route in self.collect(routes_map):
-            imports.append('from %s import %s as %s' % (route['pkg'], route['handler'], route['id']))
-            hi = route['handler_info']
-            handler_args = []
-            for arg_name in hi.arguments:
-                arg = hi.arguments.get(arg_name)
-                if arg.is_injection:
-                    continue
-                if arg.annotation == HttpRequest:
-                    continue
-                if arg.annotation == HttpSession:
-                    continue
-                handler_args.append(arg)
-
-            api_info = {
-                'id': route['id'],
-                'path': route['path'],
-                'method': route['method'],
-                'module': route['module'],
-                'name': route['name'],
-                'extname': route['extname'],
-                'handler_info': {
-                    'arguments': handler_args,
-                    'description': hi.description,
-                    'return_description': hi.return_description,
-                    'return_type': hi.return_type,
-                },
-                # 附加信息
-                'addition_info': addition_func(route) if addition_func else None
-            }
-
-            api_lines = json.dumps(
-                api_info,
-                ensure_ascii=False,
-                indent=4,
-                cls=FunctionDescription.JSONEncoder,
-            ).replace(': null', ': None').replace(': true', ': True').replace(': false', ': False').split('\n')
-
-            indented_api_lines = []
-            i = 0
-            for line in api_lines:
-                if i == 0:
-                    indented_api_lines.append(line)
-                else:
-                    indented_api_lines.append(' ' * 8 + line)
-                i += 1
+        dirname = os.path.abspath(dirname if os.path.isabs(dirname) else os.path.join(self.app_root, dirname))
+        routes_filename = os.path.abspath(os.path.join(dirname, routes_filename))
+        manifest_filename = routes_filename + '.manifest.json'
 
-            routes.append(_REGISTER_STMT.format(
-                handler=route['id'],
-                module=route['module'],
-                name=route['name'],
-                api_info='\n'.join(indented_api_lines)
-            ))
+        print('Generating routes map...')
+        if incremental:
+            manifest = self._get_manifest(routes_map, encoding, lazy)
+            files = self._load_manifest(manifest_filename, manifest['key'])
+            entries = self._find_entries(routes_map)
+
+            changed_entries = []
+            for entry in entries:
+                fullname = entry[1]
+                with open(fullname, mode='rb') as fp:
+                    file_hash = md5.hash_str(fp.read())
+                cached = files.get(fullname)
+                if cached is None or cached['hash'] != file_hash:
+                    files[fullname] = {
+                        'hash': file_hash,
+                        'imports': [],
+                        'routes': [],
+                        'bundle': [],
+                    }
+                    changed_entries.append(entry)
+
+            for route in self._collect_entries(changed_entries, workers):
+                api_info = self._get_api_info(route, addition_func)
+                import_stmt, register_stmt = self._render_route(route, api_info, lazy)
+                files[route['file']]['imports'].append(import_stmt)
+                files[route['file']]['routes'].append(register_stmt)
+                files[route['file']]['bundle'].append(b64.enc_str(self._get_bundle_record(route, api_info)))
+
+            # 按文件顺序拼接，已经删除的文件不再出现在清单中
+            manifest['files'] = {}
+            for entry in entries:
+                fullname = entry[1]
+                manifest['files'][fullname] = files[fullname]
+                imports.extend(files[fullname]['imports'])
+                routes.extend(files[fullname]['routes'])
+                if bundle:
+                    # 旧版本的清单中可能没有 bundle 项
+                    if 'bundle' not in files[fullname]:
+                        bundle = False
+                        print('Routes bundle skipped: the manifest has no bundle data, '
+                              'remove %s to regenerate it' % manifest_filename)
+                    else:
+                        bundle_records.extend(b64.dec_bytes(item) for item in files[fullname]['bundle'])
+
+            print('%d of %d file(s) changed' % (len(changed_entries), len(entries)))
+        else:
+            manifest = None
+            for route in self.collect(routes_map, workers):
+                api_info = self._get_api_info(route, addition_func)
+                import_stmt, register_stmt = self._render_route(route, api_info, lazy)
+                imports.append(import_stmt)
+                routes.append(register_stmt)
+                if bundle:
+                    bundle_records.append(self._get_bundle_record(route, api_info))
 
         content = _CODE_TPL.format(
             encoding=encoding,
-            imports='\n'.join(imports),
+            imports='\n'.join(filter(None, imports)),
             routes=',\n'.join(routes)
         )
 
         print('Routes map data generated')
 
-        dirname = os.path.abspath(dirname if os.path.isabs(dirname) else os.path.join(self.app_root, dirname))
-
         if not os.path.isdir(dirname):
             os.makedirs(dirname)
 
-        routes_filename = os.path.abspath(os.path.join(dirname, routes_filename))
-
         print('Persisting into file %s file with encoding %s' % (dirname, encoding))
 
         with open(routes_filename, mode='wt', encoding=encoding) as fp:
             fp.write(content)
 
+        if manifest is not None:
+            with open(manifest_filename, mode='wt', encoding='utf-8') as fp:
+                json.dump(manifest, fp, ensure_ascii=False)
+
+        if bundle:
+            import pickle
+            from .. import __meta__
+            bundle_filename = os.path.splitext(routes_filename)[0] + '.bundle'
+            print('Persisting routes bundle into file %s' % bundle_filename)
+            with open(bundle_filename, mode='wb') as fp:
+                pickle.dump({
+                    'version': __meta__.version,
+                    'routes': bundle_records
+                }, fp, pickle.HIGHEST_PROTOCOL)
+
         print('Routes persisted')
 
         return content
 
+    @staticmethod
+    def _get_api_info(route: dict, addition_func) -> dict:
+        """
+        生成单个路由的接口信息
+        :param route:
+        :param addition_func:
+        :return:
+        """
+        hi = route['handler_info']
+        handler_args = []
+        for arg_name in hi.arguments:
+            arg = hi.arguments.get(arg_name)
+            if arg.is_injection:
+                continue
+            if arg.annotation == HttpRequest:
+                continue
+            if arg.annotation == HttpSession:
+                continue
+            handler_args.append(arg)
+
+        api_info = {
+            'id': route['id'],
+            'path': route['path'],
+            'method': route['method'],
+            'module': route['module'],
+            'name': route['name'],
+            'extname': route['extname'],
+            'handler_info': {
+                'arguments': handler_args,
+                'description': hi.description,
+                'return_description': hi.return_description,
+                'return_type': hi.return_type,
+            },
+            # 附加信息
+            'addition_info': addition_func(route) if addition_func else None
+        }
+        return api_info
+
+    @staticmethod
+    def _render_route(route: dict, api_info: dict, lazy: bool = False):
+        """
+        生成单个路由的导入语句和注册语句
+        :param route:
+        :param api_info:
+        :param lazy: 是否使用延迟加载，此时没有导入语句，路由函数以 "模块:函数名称" 的字符串引用
+        :return: (import_stmt, register_stmt)
+        """
+        if lazy:
+            import_stmt = None
+            handler = repr('%s:%s' % (route['pkg'], route['handler']))
+        else:
+            import_stmt = 'from %s import %s as %s' % (route['pkg'], route['handler'], route['id'])
+            handler = route['id']
+
+        api_lines = json.dumps(
+            api_info,
+            ensure_ascii=False,
+            indent=4,
+            cls=FunctionDescription.JSONEncoder,
+        ).replace(': null', ': None').replace(': true', ': True').replace(': false', ': False').split('\n')
+
+        indented_api_lines = []
+        i = 0
+        for line in api_lines:
+            if i == 0:
+                indented_api_lines.append(line)
+            else:
+                indented_api_lines.append(' ' * 8 + line)
+            i += 1
+
+        register_stmt = _REGISTER_STMT.format(
+            handler=handler,
+            module=route['module'],
+            name=route['name'],
+            api_info='\n'.join(indented_api_lines)
+        )
+        return import_stmt, register_stmt
+
+    @staticmethod
+    def _get_bundle_record(route: dict, api_info: dict) -> bytes:
+        """
+        生成单个路由在预编译包中的记录。参数描述与接口文档分别序列化，以便在加载后按需反序列化
+        :param route:
+        :param api_info:
+        :return:
+        """
+        import pickle
+
+        # noinspection PyBroadException
+        try:
+            args_data = pickle.dumps(route['handler_info'].arguments, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # 参数的类型声明或者默认值不能被序列化时，在首次请求时再生成参数描述
+            args_data = None
+
+        # 文档中仅保留可 json 序列化的数据
+        doc = json.loads(json.dumps(api_info, ensure_ascii=False, cls=FunctionDescription.JSONEncoder))
+        doc_data = pickle.dumps(doc, pickle.HIGHEST_PROTOCOL)
+
+        return pickle.dumps((
+            route['method'],
+            route['path'],
+            route['pkg'],
+            route['handler'],
+            args_data,
+            doc_data,
+        ), pickle.HIGHEST_PROTOCOL)
+
+    def _get_manifest(self, routes_map: dict, encoding: str, lazy: bool) -> dict:
+        """
+        创建增量生成的清单，清单的 key 由影响生成结果的全局配置计算而来，其变化时需要全量生成
+        :param routes_map:
+        :param encoding:
+        :param lazy:
+        :return:
+        """
+        from .. import __meta__
+        key = md5.hash_str(repr((
+            __meta__.version,
+            self.append_slash,
+            encoding,
+            lazy,
+            sorted((http_prefix, str(pkg)) for (http_prefix, pkg) in routes_map.items()),
+            sorted(self.global_types),
+        )))
+        return {
+            'key': key,
+            'files': {}
+        }
+
+    @staticmethod
+    def _load_manifest(manifest_filename: str, key: str) -> dict:
+        """
+        读取清单中的文件记录
+        :param manifest_filename:
+        :param key:
+        :return: 清单不存在或者已经失效时返回空的 dict
+        """
+        if not os.path.isfile(manifest_filename):
+            return {}
+
+        # noinspection PyBroadException
+        try:
+            with open(manifest_filename, encoding='utf-8') as fp:
+                manifest = json.load(fp)
+        except Exception:
+            # 清单文件损坏时，全量生成
+            return {}
+
+        if manifest.get('key') != key:
+            return {}
+        return manifest.get('files') or {}
+
     def resolve_routes(self, filename: str, func_name: str = None):
         """
 
@@ -308,6 +547,25 @@ class Collector:
         :param func_name: 解析指定的函数
         :return:
         """
+        decorators = self._get_file_decorators(filename)
+
+        # 返回副本，以免调用方修改缓存的数据
+        if func_name is not None:
+            decorator_info = decorators.get(func_name)
+            return None if decorator_info is None else dict(decorator_info)
+
+        return [(name, dict(decorator_info)) for (name, decorator_info) in decorators.items()]
+
+    def _get_file_decorators(self, filename: str) -> dict:
+        """
+        读取文件中所有函数的 @route 装饰器信息，文件未变化时使用缓存
+        :param filename:
+        :return: {函数名称: 装饰器信息}
+        """
+        stat = os.stat(filename)
+        cached = self._parse_cache.get(filename)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
 
         self._check_entry_name(filename)
 
@@ -316,13 +574,10 @@ class Collector:
             python_fp.close()
         ast_body = ast.parse(source=''.join(lines), filename=filename).body
 
-        routes = []
+        decorators = {}
 
         for item in ast_body:
-            if not isinstance(item, ast.FunctionDef):
-                continue
-
-            if func_name is not None and item.name != func_name:
+            if not isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
                 continue
 
             # Find out the @route decorator
@@ -330,16 +585,22 @@ class Collector:
             if decorator_info is None:
                 continue
 
-            if func_name is not None:
-                return decorator_info
+            decorators[item.name] = decorator_info
 
-            routes.append((item.name, decorator_info))
+        self._parse_cache[filename] = (stat.st_mtime_ns, stat.st_size, decorators)
+        return decorators
 
-        return routes if func_name is None else None
+    def clear_cache(self):
+        """
+        清空文件解析缓存
+        :return:
+        """
+        self._parse_cache.clear()
 
-    def get_route_decorator(self, filename: str, func_def: ast.FunctionDef):
+    def get_route_decorator(self, filename: str, func_def: Union[ast.FunctionDef, ast.AsyncFunctionDef]):
         from ..util import Logger
-        logger = Logger.current()
+        # 并行解析时，工作线程中没有应用上下文
+        logger = Logger.get(self.app_id)
         for decorator in func_def.decorator_list:
             route_module = None
             route_name = None
@@ -365,10 +626,15 @@ class Collector:
                             raise Exception(msg)
                         arg_value = getattr(type_def, type_val)
                     else:
-                        # 其它类型暂时不支持
-                        # 统一使用原始值
-                        # noinspection PyProtectedMember
-                        arg_value = getattr(value, keyword.value._fields[0])
+                        # noinspection PyBroadException
+                        try:
+                            # 字面量 (包括元组/列表等)
+                            arg_value = ast.literal_eval(value)
+                        except Exception:
+                            # 其它类型暂时不支持
+                            # 统一使用原始值
+                            # noinspection PyProtectedMember
+                            arg_value = getattr(value, keyword.value._fields[0])
 
                     keywords[arg_name] = arg_value
 
@@ -1,18 +1,23 @@
-import json
 from collections import OrderedDict
-from enum import Enum
 from functools import partial, wraps
 from types import FunctionType
-from typing import Tuple, Union
+from typing import Iterator, Tuple, Union
 
-from .parameter_interface import IParam
+from werkzeug.http import http_date
+
+from .binder import ArgumentBinder
 from .validator import Validator
 from ..config import AppConfig
-from ..http import BadRequest, HttpRequest, HttpResponse, JsonResponse, ServerError
+from ..http import (
+    BadRequest, HttpRequest, HttpResponse, JsonResponse, JsonStreamResponse, ResponseStream, ServerError, StreamResponse
+)
+from ..http.conditional import is_modified, make_conditional, not_modified
 from ..routes.meta import RouteMeta
-from ..session import HttpSession
 from ..util import Logger
-from ..util.func_util import ArgumentSpecification, get_func_info
+from ..util.aio import is_async_callable, run_steps
+
+# a singleton sentinel value for parameter defaults
+_sentinel = object()
 
 
 def route(
@@ -32,6 +37,10 @@ def route(
     :param name: str 路由名称，一般在查询权限时会用到
     :param extname: 给路径指定一个扩展名，不能包含 . 符号
     :param validators: 指定参数应用的校验规则，每个需要校验的参数为元组的一个项
+    :param kwargs: 其它的自定义元数据。其中 etag, last_modified 和 cache_control 用于条件响应 (304)，见 _get_conditional
+
+    路由函数可以是 async def 函数: 通过 ASGI (App.asgi) 运行时在事件循环中执行，同步的路由函数则在线程池中执行；
+    通过 WSGI 运行时在进程内共享的后台事件循环中执行，当前线程等待其完成
     """
 
     # 支持错误的元组写法: (aaa)
@@ -40,6 +49,11 @@ def route(
         validators = (validators,)
 
     def invoke_route(handler):
+        # 参数绑定器，在首次被路由调用时根据参数声明生成
+        binder = None
+        # 路由函数是否为 async def 函数
+        is_async = is_async_callable(handler)
+
         @wraps(handler)
         def caller(*args_def):
             # 参数长度不为 2 时，认为是用户调用
@@ -59,8 +73,19 @@ def route(
             if not isinstance(request, HttpRequest) or not isinstance(handler_args, OrderedDict):
                 return handler(*args_def)
 
+            return run_steps(route_steps(request, handler_args))
+
+        def route_steps(request: HttpRequest, handler_args: OrderedDict):
+            """
+            路由调用的处理流程，见 util.aio
+            """
+            nonlocal binder
+
             config = AppConfig.current()
 
+            if binder is None or binder.args_def is not handler_args:
+                binder = ArgumentBinder(handler, handler_args)
+
             meta = RouteMeta(
                 handler,
                 handler_args,
@@ -73,8 +98,9 @@ def route(
                 kwargs=kwargs,
             )
 
-            return _invoke_with_route(request, meta, config, validators)
+            return (yield from _invoke_with_route(request, meta, config, validators, binder, is_async))
 
+        caller.route_steps = route_steps
         return caller
 
     return invoke_route
@@ -105,434 +131,142 @@ def validate_args(validators: Tuple[Validator, ...], args: dict):
     )
 
 
-def _invoke_with_route(request: HttpRequest, meta: RouteMeta, config: AppConfig, validators: tuple):
+def _invoke_with_route(request: HttpRequest, meta: RouteMeta, config: AppConfig, validators: tuple,
+                       binder: ArgumentBinder, is_async: bool):
     handler_args = meta.handler_args
     func = meta.handler
 
     mgr = config.middleware_manager
 
-    # 处理请求中的json参数
-    _process_json_args(request, config)
-
     # 调用中间件，以处理请求
-    result = mgr.handle_request(request, meta)
+    result = yield from mgr.request_steps(request, meta)
 
     # 使用函数代理，减少相同调用的参数传递
-    handle_response = partial(mgr.handle_response, request, meta)
+    handle_response = partial(mgr.response_steps, request, meta)
     wrap_response = partial(_wrap_http_response, mgr, request, meta)
 
     # 返回了 HttpResponse，直接返回此对象
     if isinstance(result, HttpResponse):
-        return handle_response(result)
+        return (yield from handle_response(result))
 
     # 返回了非 None，表示停止请求，并将结果作为路由的返回值
     if result is not None:
-        return handle_response(wrap_response(result))
+        return (yield from handle_response((yield from wrap_response(result))))
+
+    # 条件响应: 路由声明了 etag/last_modified 时，资源未变化则返回 304
+    conditional = _get_conditional(request, meta)
+    if conditional is not None and conditional[3]:
+        return (yield from handle_response(not_modified(headers=conditional[2])))
 
     # 有参数，自动从 queryString, POST 或 json 中获取
     # 匹配参数
-    actual_args = _get_actual_args(request, func, handler_args, config)
+    actual_args = binder.bind(request, config)
 
     # 只有解析参数出错时才会返回 HttpResponse
     # 此时中止执行
     if isinstance(actual_args, HttpResponse):
-        return handle_response(actual_args)
+        return (yield from handle_response(actual_args))
 
     # 调用中间件
-    result = mgr.before_invoke(request, meta, actual_args)
+    result = yield from mgr.invoke_steps(request, meta, actual_args)
 
     # 返回了 HttpResponse ， 直接返回此对象
     if isinstance(result, HttpResponse):
-        return handle_response(result)
+        return (yield from handle_response(result))
 
     # 返回了非 None，表示停止请求，并将结果作为路由的返回值
     if result is not None:
-        return handle_response(wrap_response(result))
+        return (yield from handle_response((yield from wrap_response(result))))
 
     # 执行校验
     result = validate_args(validators, actual_args)
     if result is not None:
-        return handle_response(BadRequest(result, content_type='text/plain'))
+        return (yield from handle_response(BadRequest(result, content_type='text/plain')))
 
-    # 调用路由函数
+    # 调用路由函数，同步的路由函数是可能阻塞的调用
     arg_len = len(handler_args)
 
     try:
         if arg_len == 0:
-            result = func()
+            result = yield func, (), not is_async
         else:
-            result = func(**actual_args)
+            result = yield partial(func, **actual_args), (), not is_async
     except Exception as e:
         from ..util import utils
         msg = 'Error occurred during executing the route handler: %s' % str(e)
         Logger.current().error(utils.get_exception_info(e, msg), e)
         if config.debug:
             raise e
-        return handle_response(ServerError())
-
-    return handle_response(wrap_response(result))
-
-
-def _process_json_args(request: HttpRequest, config: AppConfig):
-    """
-    参数处理
-    :return:
-    """
-    if request.content_type is None or 'application/json' not in request.content_type:
-        return
-
-    # 如果请求是json类型，就先处理一下
-
-    body = request.data
-
-    if not body:
-        return
-
-    try:
-        request.BODY = json.loads(body.decode())
-    except Exception as e:
-        Logger.current().warning('Failed to deserialize request body: %s' % str(e))
+        return (yield from handle_response(ServerError()))
 
+    response = yield from handle_response((yield from wrap_response(result)))
+    if conditional is None:
+        return response
 
-def _get_parameter_str(args_def: OrderedDict):
-    return ', '.join(filter(lambda n: n[0] != '_', [str(args_def[arg]) for arg in args_def]))
+    etag, last_modified, headers, _ = conditional
+    return make_conditional(request, response, etag, last_modified, headers.get('Cache-Control'))
 
 
-def _get_value(data: dict, name: str, arg_spec: ArgumentSpecification):
-    """
-
-    :param data:
-    :param name:
-    :param arg_spec:
-    :return: True 表示使用默认值 False 表示未使用默认值 None 表示无值
+def _get_conditional(request: HttpRequest, meta: RouteMeta):
     """
-    alias = arg_spec.alias
-    # 提供对 a[]=1&a[]=2 的支持
-    name_arr = name + '[]'
-    is_arr = False
-    if name in data:
-        result = False, data.get(name)
-    elif alias:
-        result = None, None
-        for an in alias:
-            an_arr = an + '[]'
-            if an in data:
-                result = False, data.get(an)
-                break
-            if an_arr in data:
-                is_arr = True
-                result = False, data.get(an_arr)
-                break
-        if result[0] is None:
-            if arg_spec.has_default:
-                # 使用默认值
-                result = True, arg_spec.default
-            else:
-                # 缺少无默认值的参数
-                result = None, None
-    elif name_arr in data:
-        is_arr = True
-        result = False, data.get(name_arr)
-    elif arg_spec.has_default:
-        # 使用默认值
-        result = True, arg_spec.default
-    else:
-        # 缺少无默认值的参数
-        result = None, None
-
-    use_default, value = result
+    获取路由声明的条件响应参数:
 
-    # 特别地，针对枚举类型，传入空时使用默认值
-    if arg_spec.is_type(Enum):
-        if isinstance(value, list):
-            temp = value[-1]
-        else:
-            temp = value
-        if temp is None or temp == '':
-            return True, arg_spec.default
-
-    if use_default is not False:
-        return result
+    - etag: 为 True 时根据响应内容计算，为函数时使用其返回值 (路由函数提供的版本号)，函数接收一个参数 request
+    - last_modified: 函数，返回资源的最后修改时间 (datetime 或时间戳)，函数接收一个参数 request
+    - cache_control: Cache-Control 响应头的值
 
-    if is_arr:
-        # 请求参数本就为数组: param[]
-        # 返回为 tuple 类型
-        return use_default, tuple(value)
-
-    # 当请求的不是数组时，使用最后一个值
-    return use_default, value
-
-
-def _get_enum_value(arg_spec, arg_value):
-    # 此处的判断，始终忽略大小写
-    tv = str(arg_value).lower()
-    for enum_item in arg_spec.annotation:
-        # 先判断值
-        # 再判断名称
-        if str(enum_item.value).lower() == tv or str(enum_item.name).lower() == tv:
-            # 命中了此枚举项
-            return enum_item
-    # 没有命中
-    return None
-
-
-def _get_input_value(arg_spec: ArgumentSpecification, arg_name, arg_value, config):
-    # 未指定类型
-    if not arg_spec.has_annotation:
-        return arg_value
-
-    # 当值为 None 时，不作数据类型校验
-    if arg_value is None:
-        return arg_value
-
-    # 声明的类型为 IParam，调用  parse 进行转换
-    if arg_spec.is_type(IParam):
-        try:
-            return arg_spec.annotation.parse(arg_value)
-        except Exception as ex:
-            msg = 'Cannot parse value "%s" as type "%s" for parameter "%s": %s' % (
-                arg_value, arg_spec.annotation_name, arg_name, str(ex)
-            )
-            Logger.current().warning(msg)
-            return BadRequest(msg)
-
-    # 检查类型是否一致 #
-
-    # 类型一致，直接使用
-    if isinstance(arg_value, arg_spec.annotation):
-        return arg_value
-
-    # 类型不一致，尝试转换类型
-    if arg_spec.annotation is tuple and isinstance(arg_value, list):
-        return tuple(arg_value)
-
-    if arg_spec.annotation is list and isinstance(arg_value, tuple):
-        return list(arg_value)
-
-    # 当声明的参数类型是布尔类型时，收到的值可能是一个字符串（其值为 true 、 false）
-    if arg_spec.annotation is bool and isinstance(arg_value, str):
-        if arg_value == 'true':
-            return True
-        if arg_value == 'false':
-            return False
-
-        msg = 'Cannot parse value "%s" as type "%s for parameter %s". (expected: true/false)' % (
-            arg_value, arg_spec.annotation_name, arg_name
-        )
-        Logger.current().warning(msg)
-        return BadRequest(msg)
-
-    # 当声明的参数类型是枚举类型时，遍历枚举项，同时将枚举名称与值进行处理
-    if arg_spec.is_type(Enum):
-        result = _get_enum_value(arg_spec, arg_value)
-        if result is None:
-            msg = 'Cannot parse value "%s" as type "%s" for parameter "%s".' % (
-                arg_value, arg_spec.annotation_name, arg_name
-            )
-            Logger.current().warning(msg)
-            return BadRequest(msg)
-
-        return result
-
-    # 转换失败时，会抛出异常
-    # noinspection PyBroadException
-    try:
-        # 当 arg_value 是字符串，arg_spec的类型是对象时，尝试解析成 json
-        if arg_spec.annotation in (dict, list) and isinstance(arg_value, str):
-            # noinspection PyBroadException
-            try:
-                arg_value = json.loads(arg_value)
-            except Exception:
-                # 此处的异常直接忽略即可
-                msg = 'Cannot parse value "%s" as type "%s" for parameter "%s".' % (
-                    arg_value, arg_spec.annotation_name, arg_name
-                )
-                Logger.current().warning(msg)
-                return BadRequest(msg)
-
-        # 类型一致，直接使用
-        if isinstance(arg_value, arg_spec.annotation):
-            # 如果原始声明是 tuple 类型，那么把 list 转换成 tuple
-            # 虽然在发起请求的时候并不能指定为 tuple，但还是想兼容一下
-            return tuple(arg_value) if arg_spec.is_tuple else arg_value
-        return arg_spec.annotation(arg_value)
-    except Exception:
-        msg = 'Cannot parse value "%s" as type "%s" for parameter "%s".' % (
-            arg_value, arg_spec.annotation_name, arg_name
-        )
-        Logger.current().warning(msg)
-        return BadRequest(msg)
-
-
-def _fill_session(request, func, arg_spec, arg_name, args_def, config):
-    # 以下情况将传入 HttpSession 对象
-    # 1. 当参数名称是 session 并且未指定类型
-    # 2. 当参数类型是 HttpSession 时 (不论参数名称，包括 session)
-    # 但是，参数名称是 session 但其类型不是 HttpSession ，就会被当作一般参数处理
-    is_session = False
-    if arg_name == 'session' and not arg_spec.has_annotation:
-        is_session = True
-    elif arg_spec.annotation == HttpSession:
-        is_session = True
-
-    if is_session:
-        if request.session is None:
-            msg = '%s\n\tParameter "%s" of type "HttpSession" is not available, ' \
-                  'the value will always be "None", ' \
-                  'please make sure that you have registered the Session-Middleware correctly, ' \
-                  'Parameters: (%s)' % (
-                      get_func_info(func),
-                      arg_name,
-                      _get_parameter_str(args_def)
-                  )
-            Logger.current().warning(msg)
-        # 在 session 未启用时，其值为 None
-        return request.session
-    return None
-
-
-def _fill_injections(request, func, injection_args, actual_args, config):
-    # 填充注入参数
-    for arg_name in injection_args:
-        # 注入名称不包含前缀 _
-        # 所以要 [1:]
-        injection_name = arg_name[1:]
-        # noinspection PyProtectedMember
-        if injection_name in request._injections:
-            # noinspection PyProtectedMember
-            actual_args[arg_name] = request._injections[injection_name]
-            continue
-
-        if injection_name in config.injections:
-            actual_args[arg_name] = config.injections[injection_name]
-            continue
-
-        msg = 'Injection name "%s" not found.' % injection_name
-        if config.debug:
-            msg = '%s\n\t%s' % (get_func_info(func), msg)
-        Logger.current().error(msg)
-        return ServerError(msg) if config.debug else ServerError()
-    return None
-
-
-def _get_variable_args(arg_source, used_args):
-    # 填充可变参数
-    variable_args = {}
-    for item in arg_source:
-        if item in used_args:
-            continue
-        value = arg_source.get(item)
-        # 当值长度大于1时，使用 tuple
-        # 或者 item 以 [] 结尾
-        if item.endswith('[]'):
-            variable_args[item[:-2]] = tuple(value)
-            continue
-        variable_args[item] = value
-
-    return variable_args
-
-
-def _get_actual_args(request: HttpRequest, func, args_def: OrderedDict, config: AppConfig) -> dict or HttpResponse:
-    actual_args = {}
-
-    # 已使用的参数名称，用于后期填充可变参数时作排除用
-    used_args = []
-    # 是否声明了可变参数
-    has_variable_args = False
-
-    # 合并参数成一个对象
-    # 注意：不同来源（get/post）的参数会被覆盖 (post 覆盖 get) 的值
-    arg_source = dict(request.GET)
-    arg_source.update(dict(request.POST))
-    if isinstance(request.BODY, dict):
-        arg_source.update(request.BODY)
-    if isinstance(request.FILES, dict):
-        arg_source.update(request.FILES)
-
-    # 声明的注入参数集合
-    injection_args = []
-
-    for arg_name in args_def.keys():
-        arg_spec = args_def.get(arg_name)
-
-        if arg_spec.is_injection:
-            injection_args.append(arg_name)
-            used_args.append(arg_name)
-            continue
-
-        # 如果是可变参数：如: **kwargs
-        # 设置标记，以在后面进行填充
-        if arg_spec.is_variable:
-            has_variable_args = True
-            continue
-
-        # 以下情况将传入 HttpRequest 对象
-        # 1. 当参数名称是 request 并且未指定类型
-        # 2. 当参数类型是 HttpRequest 时 (不论参数名称，包括 request)
-        # 但是，参数名称是 request 但其类型不是 HttpRequest ，就会被当作一般参数处理
-        if arg_name == 'request' and not arg_spec.has_annotation:
-            actual_args[arg_name] = request
-            continue
-        if arg_spec.annotation == HttpRequest:
-            actual_args[arg_name] = request
-            continue
-
-        # 填充 session
-        sess = _fill_session(request, func, arg_spec, arg_name, args_def, config)
-        if sess:
-            actual_args[arg_name] = sess
-            continue
-
-        use_default, arg_value = _get_value(arg_source, arg_name, arg_spec)
+    :return: 未声明或者不是 GET/HEAD 请求时返回 None，否则返回 (etag, last_modified, headers, 资源是否未变化)
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
 
-        # 未找到参数
-        if use_default is None:
-            msg = 'Missing required argument "%s".' % arg_name
-            Logger.current().warning(msg)
-            return BadRequest(msg)
+    etag = meta.get('etag')
+    last_modified = meta.get('last_modified')
+    cache_control = meta.get('cache_control')
+    if not etag and last_modified is None and cache_control is None:
+        return None
 
-        # 使用默认值
-        if use_default is True:
-            actual_args[arg_name] = arg_value
-            used_args.append(arg_name)
-            continue
+    headers = {}
+    if cache_control:
+        headers['Cache-Control'] = cache_control
 
-        val = _get_input_value(arg_spec, arg_name, arg_value, config)
+    if callable(etag):
+        etag = etag(request)
+        if etag is not None:
+            etag = str(etag)
+            headers['ETag'] = '"%s"' % etag
+    else:
+        # 为 True 时，在调用路由函数后根据响应内容计算
+        etag = True if etag else None
 
-        if isinstance(val, HttpResponse):
-            return val
-        actual_args[arg_name] = val
-        used_args.append(arg_name)
+    if callable(last_modified):
+        last_modified = last_modified(request)
+    else:
+        last_modified = None
 
-    result = _fill_injections(request, func, injection_args, actual_args, config)
-    if isinstance(result, HttpResponse):
-        return result
+    # 只有路由函数提供了版本号或者修改时间时，才能在调用路由函数前判断资源是否变化
+    version = etag if isinstance(etag, str) else None
+    unmodified = (version is not None or last_modified is not None) and not is_modified(request, version, last_modified)
+    if unmodified and last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
 
-    variable_args = _get_variable_args(arg_source, used_args)
+    return etag, last_modified, headers, unmodified
 
-    # 没有可变参数
-    if not variable_args:
-        return actual_args
 
-    # 有可变参数，并且指定了 kwargs
-    if has_variable_args:
-        actual_args.update(variable_args)
-        return actual_args
+def _stream_with_context(request: HttpRequest, iterator: Iterator):
+    """
+    在迭代时保持请求上下文，以便生成器中可以继续使用 HttpRequest.current() 等上下文对象
+    """
 
-    # 有可变参数，并且未指定 kwargs
-    # 未启用严格模式
-    if config.strict_mode is not True:
-        return actual_args
+    def generate():
+        with request.context():
+            # 在此处暂停，以便在返回前进入上下文
+            yield None
+            yield from iterator
 
-    # 启用了严格模式
-    # 返回 400 响应
-    variable_arg_keys = variable_args.keys()
-    msg = 'Unknown argument(s) found: "%s", Parameters: (%s).' \
-          % (','.join(variable_arg_keys), _get_parameter_str(args_def))
-    Logger.current().warning(msg)
-    if not config.debug:
-        msg = 'Unknown argument(s) found: %s.' % ','.join(variable_arg_keys)
-    return BadRequest(msg)
+    gen = generate()
+    next(gen)
+    return gen
 
 
 def _wrap_http_response(mgr, request, meta, data):
@@ -542,8 +276,12 @@ def _wrap_http_response(mgr, request, meta, data):
     :return:
     """
 
+    # 迭代器/生成器 (包括使用 yield 的路由函数的返回值)，包装成数据流后再交给中间件处理
+    if isinstance(data, Iterator) and not isinstance(data, ResponseStream):
+        data = ResponseStream(_stream_with_context(request, data))
+
     # 调用中间件，处理返回函数
-    data = mgr.after_return(request, meta, data)
+    data = yield from mgr.return_steps(request, meta, data)
 
     if data is None:
         return HttpResponse()
@@ -557,6 +295,15 @@ def _wrap_http_response(mgr, request, meta, data):
     if isinstance(data, (dict, list, set, tuple)):
         return JsonResponse(data)
 
+    # 数据流中是 bytes/str 时，按原样分块返回，否则作为 JSON 数组返回
+    if isinstance(data, Iterator):
+        if not isinstance(data, ResponseStream):
+            data = ResponseStream(_stream_with_context(request, data))
+        first = data.peek(_sentinel)
+        if isinstance(first, (bytes, str)):
+            return StreamResponse(data)
+        return JsonStreamResponse(data)
+
     if isinstance(data, str):
         return HttpResponse(data.encode(), content_type='text/plain')
 
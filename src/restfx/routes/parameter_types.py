@@ -1,6 +1,5 @@
-import json
-
 from restfx import IParam
+from restfx.util import serializer
 
 
 class JsonType(IParam):
@@ -22,7 +21,7 @@ class JsonType(IParam):
         if value[0] not in ('{', '[') or value[-1] not in ('}', ']'):
             raise Exception('Invalid JSON string')
 
-        return json.loads(value)
+        return serializer.current().loads(value)
 
     def __init__(self):
         self.data = None
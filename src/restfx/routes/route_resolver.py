@@ -1,5 +1,5 @@
 import os
-from typing import Dict, Optional
+from typing import Dict
 
 from ..config import AppConfig
 from ..http.response import NotFound, HttpResponse
@@ -9,17 +9,35 @@ from ..util.func_util import FunctionDescription
 
 class RouteResolver:
     def __init__(self, config: AppConfig,
-                 entry_cache: Dict[str, Optional[FunctionDescription]],
+                 entry_cache: Dict[str, FunctionDescription],
                  method: str,
-                 entry: str):
+                 entry: str,
+                 route_table=None,
+                 missing_cache=None):
+        """
+
+        :param config:
+        :param entry_cache: 已找到的路由函数描述缓存，未找到的入口只记录在有上限的 missing_cache 中
+        :param method:
+        :param entry:
+        :param route_table: 编译后的路由表，指定时不再遍历映射表和访问文件系统
+        :type route_table: RouteTable
+        :param missing_cache: 未找到的入口缓存，其键为 (entry, method)
+        :type missing_cache: LRUCache
+        """
         self.config = config
         self.entry_cache = entry_cache
+        self.route_table = route_table
+        self.missing_cache = missing_cache
         self.entry = entry
         self.method = method.lower()
         from ..util import Logger
         self.logger = Logger.current()
 
     def _get_module_abs_path(self, module_name):
+        if self.route_table is not None:
+            return self.route_table.find_module(module_name)
+
         abs_path = os.path.join(self.config.ROOT, module_name)
 
         if os.path.isdir(abs_path):
@@ -36,6 +54,19 @@ class RouteResolver:
         if not method:
             method = self.method
 
+        if self.missing_cache is None:
+            return self._resolve(method)
+
+        cache_key = (self.entry, method)
+        if self.missing_cache.get(cache_key):
+            return NotFound()
+
+        desc = self._resolve(method)
+        if isinstance(desc, HttpResponse):
+            self.missing_cache.set(cache_key, True)
+        return desc
+
+    def _resolve(self, method: str) -> [FunctionDescription, HttpResponse]:
         # entry 可能包含扩展名
         temp = self.entry.split('.')
         entry = temp[0]
@@ -93,6 +124,9 @@ class RouteResolver:
         return desc
 
     def get_route_map(self, route_path):
+        if self.route_table is not None:
+            return self.route_table.match(route_path)
+
         # 命中
         hit_route = None
         for root_path in self.config.routes_map:
@@ -108,8 +142,9 @@ class RouteResolver:
 
     def _get_handler_info(self, module_name, func_name, fullname) -> [FunctionDescription, HttpResponse]:
         # 缓存中有这个函数
-        if fullname in self.entry_cache.keys():
-            return self.entry_cache[fullname]
+        desc = self.entry_cache.get(fullname)
+        if desc is not None:
+            return desc
 
         # 缓存中没有这个函数，去模块中查找
         # ---------------
@@ -123,8 +158,7 @@ class RouteResolver:
 
         # 模块中也没有这个函数
         if not hasattr(entry_define, func_name):
-            # 函数不存在，更新缓存
-            self.entry_cache[func_name] = None
+            # 函数不存在 (由 missing_cache 缓存)
             return NotFound()
 
         # 模块中有这个函数
@@ -141,8 +175,7 @@ class RouteResolver:
                 fullname
             )
             self.logger.warning(msg)
-            # 没有配置装饰器@route，则认为函数不可访问，更新缓存
-            self.entry_cache[func_name] = None
+            # 没有配置装饰器@route，则认为函数不可访问 (由 missing_cache 缓存)
             return NotFound()
 
         func_desc = FunctionDescription(func)
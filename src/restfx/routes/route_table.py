@@ -0,0 +1,265 @@
+import inspect
+import os
+from threading import Lock
+from typing import Optional, Tuple
+
+
+class _PrefixNode:
+    """
+    前缀树节点，每一级对应 url 路径中的一段
+    """
+    __slots__ = ('children', 'target')
+
+    def __init__(self):
+        self.children = {}
+        """
+        :type: Dict[str, _PrefixNode]
+        """
+        # 映射到此节点的包，为 None 表示此节点不是一个映射前缀
+        self.target = None
+
+
+class RouteTable:
+    """
+    编译后的路由表
+
+    - 完整路由 (method + path) 使用 dict 精确匹配
+    - map_routes 注册的前缀使用前缀树匹配，查找耗时只与路径的深度相关，与映射的包数量无关
+    - 映射目录下的模块在编译时一次性扫描，查找模块时不再访问文件系统
+    """
+
+    def __init__(self):
+        self.routes = {}
+        """
+        精确匹配的路由集合，其键为 /path#method
+        :type: Dict[str, dict]
+        """
+        self.root = _PrefixNode()
+        self.modules = {}
+        """
+        映射目录下的模块索引，其键为模块路径（使用系统路径分隔符），值为实际要加载的模块路径
+        :type: Dict[str, str]
+        """
+        self.compiled = False
+        self.hits = {}
+        """
+        路由命中计数，只记录已经注册的路由，可以通过 reset_hits 清空
+        :type: Dict[str, int]
+        """
+        self._hits_lock = Lock()
+        self._load_lock = Lock()
+
+    def add(self, rid: str, route: dict):
+        """
+        添加一个完整路由
+        :param rid: 路由 id, 格式为 /path#method
+        :param route:
+        :return: 路由已经存在时返回 False
+        """
+        exists = rid in self.routes
+        self.routes[rid] = route
+        return not exists
+
+    def add_lazy(self, rid: str, pkg: str, handler: str, args_data: bytes = None):
+        """
+        添加一个延迟加载的完整路由，路由函数所在模块在首次请求时才会导入
+        :param rid: 路由 id, 格式为 /path#method
+        :param pkg: 路由函数所在的模块
+        :param handler: 路由函数名称
+        :param args_data: 预先生成并序列化的参数描述，为 None 时在首次请求时生成
+        :return: 路由已经存在时返回 False
+        """
+        return self.add(rid, {
+            'func': None,
+            'args': None,
+            'pkg': pkg,
+            'handler': handler,
+            'args_data': args_data
+        })
+
+    def get(self, rid: str) -> Optional[dict]:
+        """
+        精确查找路由，并更新命中计数
+        :param rid:
+        :return:
+        """
+        route = self.routes.get(rid)
+        if route is not None:
+            with self._hits_lock:
+                self.hits[rid] = self.hits.get(rid, 0) + 1
+            if route['func'] is None or route['args'] is None:
+                self.load(route)
+        return route
+
+    def load(self, route: dict):
+        """
+        加载延迟加载的路由：导入路由函数并生成参数描述
+        :param route:
+        :return:
+        """
+        with self._load_lock:
+            if route['func'] is None:
+                from ..util import utils
+                route['func'] = getattr(utils.load_module(route['pkg']), route['handler'])
+
+            if route['args'] is None:
+                if route.get('args_data') is None:
+                    from ..util.func_util import FunctionDescription
+                    route['args'] = FunctionDescription(route['func']).arguments
+                else:
+                    import pickle
+                    route['args'] = pickle.loads(route['args_data'])
+                    route['args_data'] = None
+
+    def warmup(self, logger=None):
+        """
+        加载所有延迟加载的路由
+        :param logger: 指定时，加载失败的路由会被记录并跳过，否则抛出异常
+        :return: 加载的路由数量
+        """
+        count = 0
+        for rid, route in list(self.routes.items()):
+            if route['func'] is not None and route['args'] is not None:
+                continue
+            try:
+                self.load(route)
+            except Exception as e:
+                if logger is None:
+                    raise e
+                logger.error('Failed to load route %s' % rid, e)
+                continue
+            count += 1
+        return count
+
+    def invalidate(self):
+        """
+        标记前缀表需要重新编译，在路由映射变化后调用
+        :return:
+        """
+        self.compiled = False
+
+    def compile(self, routes_map: dict, app_root: str):
+        """
+        根据路由映射表编译前缀树和模块索引
+        :param routes_map: 路由映射表，其键为请求的路径，其值为映射的包
+        :param app_root: 应用的根目录
+        :return:
+        """
+        root = _PrefixNode()
+        modules = {}
+
+        for http_prefix, pkg in routes_map.items():
+            node = root
+            for seg in self._split(http_prefix):
+                child = node.children.get(seg)
+                if child is None:
+                    child = _PrefixNode()
+                    node.children[seg] = child
+                node = child
+            # 先注册的映射优先
+            if node.target is None:
+                node.target = pkg
+
+            self._index_modules(pkg, app_root, modules)
+
+        self.root = root
+        self.modules = modules
+        self.compiled = True
+
+    def match(self, route_path: str) -> Optional[str]:
+        """
+        查找请求路径对应的模块名称（使用 . 分隔）
+        :param route_path: 请求路径，不包含 api 前缀
+        :return: 未命中任何映射时返回 None
+        """
+        segments = self._split(route_path)
+
+        node = self.root
+        hit = None
+        hit_depth = 0
+        depth = 0
+        for seg in segments:
+            node = node.children.get(seg)
+            if node is None:
+                break
+            depth += 1
+            if node.target is not None:
+                hit = node.target
+                hit_depth = depth
+
+        if hit is None:
+            return None
+
+        if not isinstance(hit, str):
+            hit = hit.__name__
+
+        return '.'.join([hit] + segments[hit_depth:]).strip('.')
+
+    def find_module(self, module_path: str) -> Optional[str]:
+        """
+        从模块索引中查找模块
+        :param module_path: 模块路径（使用系统路径分隔符）
+        :return: 实际要加载的模块路径，模块不存在时返回 None
+        """
+        return self.modules.get(module_path)
+
+    def reset_hits(self):
+        """
+        清空路由命中计数
+        :return:
+        """
+        with self._hits_lock:
+            self.hits = {}
+
+    def stats(self) -> dict:
+        """
+        路由表的统计信息，hits 为自上次 reset_hits 以来所有路由的命中次数
+        :return:
+        """
+        with self._hits_lock:
+            hits = sum(self.hits.values())
+        return {
+            'routes': len(self.routes),
+            'modules': len(self.modules),
+            'hits': hits,
+        }
+
+    @staticmethod
+    def _split(route_path: str):
+        return [seg for seg in route_path.split('/') if seg]
+
+    @staticmethod
+    def _get_pkg_root(pkg, app_root: str) -> Tuple[Optional[str], Optional[str]]:
+        if isinstance(pkg, str):
+            return pkg, os.path.abspath(os.path.join(app_root, pkg.replace('.', os.path.sep)))
+
+        module_path = getattr(pkg, '__file__', None)
+        if module_path is None:
+            return None, None
+        module_path = inspect.getfile(pkg)
+        if not module_path.endswith('__init__.py'):
+            return None, None
+        return pkg.__name__, os.path.dirname(module_path)
+
+    @classmethod
+    def _index_modules(cls, pkg, app_root: str, modules: dict):
+        pkg_name, pkg_root = cls._get_pkg_root(pkg, app_root)
+        if pkg_root is None or not os.path.isdir(pkg_root):
+            return
+
+        pkg_path = pkg_name.replace('.', os.path.sep)
+        for (current_path, dirs, files) in os.walk(pkg_root):
+            if os.path.basename(current_path) == '__pycache__':
+                continue
+
+            rel_path = os.path.relpath(current_path, pkg_root)
+            dir_path = pkg_path if rel_path == '.' else os.path.join(pkg_path, rel_path)
+
+            # 目录作为包加载
+            modules[dir_path] = '%s%s%s' % (dir_path, os.path.sep, '__init__')
+
+            for file in files:
+                if not file.endswith('.py') or file == '__init__.py':
+                    continue
+                file_path = os.path.join(dir_path, file[0:-3])
+                modules.setdefault(file_path, file_path)
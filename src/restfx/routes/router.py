@@ -1,21 +1,40 @@
 from types import FunctionType
 
 from .route_resolver import RouteResolver
+from .route_table import RouteTable
 from ..config import AppConfig
 from ..http import HttpResponse, NotFound
 from ..http.request import HttpRequest
+from ..util.aio import run_steps
+from ..util.lru_cache import LRUCache
 
 
 class Router:
+    # 未找到的入口缓存的最大数量
+    MISSING_CACHE_SIZE = 4096
+    # 未找到的入口缓存的有效时长，单位为秒
+    MISSING_CACHE_TTL = 300
+
     def __init__(self, config: AppConfig):
         self.config = config
         # 函数缓存，减少 inspect 反射调用次数
         self.entry_cache = {}
         """
-        :type:Dict[str, Optional[FunctionDescription]]
+        :type:Dict[str, FunctionDescription]
         """
+        # 编译后的路由表
+        self.route_table = RouteTable()
         # 线上模式时，使用固定路由
-        self.production_routes = {}
+        self.production_routes = self.route_table.routes
+        # 未找到的入口缓存，其键为 (entry, method)，用于减少无效请求的文件系统和 AST 解析开销
+        self.missing_cache = LRUCache(self.MISSING_CACHE_SIZE, self.MISSING_CACHE_TTL)
+
+    def compile_routes(self):
+        """
+        编译路由映射表
+        :return:
+        """
+        self.route_table.compile(self.config.routes_map, self.config.ROOT)
 
     def dispatch(self, request: HttpRequest, entry):
         """
@@ -24,29 +43,60 @@ class Router:
         :param entry: 入口地址
         :return:
         """
+        return run_steps(self.dispatch_steps(request, entry))
+
+    def dispatch_steps(self, request: HttpRequest, entry):
+        """
+        路由分发的处理流程，见 util.aio
+        :param request: 请求
+        :param entry: 入口地址
+        :return:
+        """
         method = request.method.lower()
         rid = '/%s#%s' % (entry, method)
 
-        if rid in self.production_routes:
-            route = self.production_routes[rid]
-            return self.invoke_handler(request, route['func'], route['args'])
+        route = self.route_table.get(rid)
+        if route is not None:
+            return (yield from self.invoke_steps(request, route['func'], route['args']))
 
         if self.config.debug:
             return NotFound()
 
+        if not self.route_table.compiled:
+            self.compile_routes()
+
         resolver = RouteResolver(self.config,
                                  self.entry_cache,
-                                 method.lower(), entry)
+                                 method.lower(), entry,
+                                 self.route_table,
+                                 self.missing_cache)
 
         route = resolver.resolve()
         if isinstance(route, HttpResponse):
             return route
 
-        return self.invoke_handler(request, route.func, route.arguments)
+        return (yield from self.invoke_steps(request, route.func, route.arguments))
+
+    def stats(self) -> dict:
+        """
+        路由的统计信息
+        :return:
+        """
+        return {
+            'route_table': self.route_table.stats(),
+            'missing_cache': self.missing_cache.stats(),
+        }
 
     def invoke_handler(self, request, func: FunctionType, args):
+        return run_steps(self.invoke_steps(request, func, args))
+
+    @staticmethod
+    def invoke_steps(request, func: FunctionType, args):
         try:
-            return func(request, args)
+            route_steps = getattr(func, 'route_steps', None)
+            if route_steps is None:
+                return (yield func, (request, args), True)
+            return (yield from route_steps(request, args))
         except Exception as e:
             from ..util import Logger, func_util
             Logger.current().error(func_util.get_func_info(func), e)
@@ -0,0 +1,206 @@
+import mimetypes
+import os
+import re
+import stat
+import time
+from typing import Optional, Tuple
+
+from ..config import AppConfig
+from ..http import FileResponse
+from ..http.conditional import is_modified, not_modified
+from ..util.lru_cache import LRUCache
+
+
+class StaticFiles:
+    """
+    静态资源处理，由 static_map 映射的目录提供文件
+
+    - 文件的 stat 信息会缓存 stat_ttl 秒，过期后重新读取
+    - 文件名中包含哈希 (如 app.3f2a9c1e.js) 的资源使用长期缓存，
+      其它格式的哈希 (如 index-BX3k9aQz.js) 可以通过修改 HASHED_PATTERN 支持
+    - 支持 ETag/Last-Modified 条件请求 (304) 以及 Range 请求
+    - 完整的文件通过 wsgi.file_wrapper 输出
+    - memory_prefixes 中的目录下的小文件会缓存在内存中
+    - 映射到根路径 (/) 的目录不处理接口前缀以及自定义 url 映射下的路径，见 exclude
+    """
+
+    # 匹配文件名中位于两个 . 之间的十六进制哈希 (至少 8 位，并且包含字母，以排除 app.20240101.js 这样的日期)
+    HASHED_PATTERN = re.compile(r'\.(?=[0-9a-f]*[a-f])[0-9a-f]{8,}\.[^./]+$')
+    # 带哈希的资源的 Cache-Control
+    HASHED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    def __init__(self, config: AppConfig, max_age: int = 60 * 60 * 12, stat_ttl: float = 2,
+                 stat_cache_size: int = 4096, memory_file_size: int = 64 * 1024, memory_cache_size: int = 256):
+        """
+
+        :param config:
+        :param max_age: 不带哈希的资源的缓存时长，单位为秒
+        :param stat_ttl: 文件 stat 信息的缓存时长，单位为秒，指定为 0 表示不缓存
+        :param stat_cache_size: 最多缓存的文件 stat 信息数量
+        :param memory_file_size: 缓存在内存中的文件的最大大小，单位为字节
+        :param memory_cache_size: 最多缓存在内存中的文件数量
+        """
+        self.config = config
+        self.max_age = max_age
+        self.stat_ttl = stat_ttl
+        self.memory_file_size = memory_file_size
+        # 需要将文件缓存在内存中的前缀
+        self.memory_prefixes = {'/internal_assets'}
+        self.stat_cache = LRUCache(stat_cache_size)
+        self.memory_cache = LRUCache(memory_cache_size)
+        # 按前缀长度倒序排列的 (前缀, 目录)，在首次请求时生成
+        self._mounts = None
+        # 映射到根路径时，不作为静态资源处理的路径以及路径前缀
+        self.excluded_paths = set()
+        self.excluded_prefixes = ()
+
+    def exclude(self, url: str):
+        """
+        映射到根路径的目录不处理指定的路径，用于接口以及自定义的 url 映射
+        :param url: 路径，可以是 werkzeug 的规则，如 /test/<param>，此时排除 /test/ 开头的路径
+        :return:
+        """
+        if '<' not in url:
+            self.excluded_paths.add(url)
+            return
+        prefix = url.split('<', 1)[0]
+        # 如 /<path:p> 这样匹配所有路径的规则，不排除，否则根路径下的静态资源都无法访问
+        if prefix != '/' and prefix not in self.excluded_prefixes:
+            self.excluded_prefixes += (prefix,)
+
+    def invalidate(self):
+        """
+        清除缓存，在 static_map 或者静态文件发生变化时调用
+        :return:
+        """
+        self._mounts = None
+        self.stat_cache.clear()
+        self.memory_cache.clear()
+
+    def _get_mounts(self):
+        mounts = self._mounts
+        if mounts is None:
+            mounts = [
+                (prefix.rstrip('/'), directory)
+                for prefix, directory in sorted(self.config.static_map.items(),
+                                                key=lambda item: len(item[0]), reverse=True)
+            ]
+            self._mounts = mounts
+        return mounts
+
+    def match(self, path: str) -> Optional[Tuple[str, str]]:
+        """
+        查找请求路径对应的文件
+        :param path:
+        :return: (前缀, 文件的绝对路径)，路径不在静态目录下或者路径不安全时返回 None
+        """
+        for prefix, directory in self._get_mounts():
+            if path == prefix or path.startswith(prefix + '/'):
+                if not prefix and (path in self.excluded_paths or path.startswith(self.excluded_prefixes)):
+                    return None
+                from werkzeug.security import safe_join
+                file_path = safe_join(directory, path[len(prefix) + 1:])
+                if file_path is None:
+                    return None
+                return prefix, file_path
+        return None
+
+    def match_request(self, request) -> Optional[Tuple[str, str]]:
+        """
+        查找请求对应的文件，只检查请求路径，不访问文件系统
+        :param request:
+        :return: (前缀, 文件的绝对路径)，请求的不是静态目录下的路径时返回 None
+        """
+        if not self.config.static_map or request.method not in ('GET', 'HEAD'):
+            return None
+        return self.match(request.path)
+
+    def maybe_exists(self, file_path: str) -> bool:
+        """
+        根据缓存的 stat 信息判断文件是否可能存在，不访问文件系统
+        :param file_path:
+        :return: 已知文件不存在时返回 False
+        """
+        cached = self.stat_cache.get(file_path)
+        return cached is None or cached[1] is not None or cached[0] <= time.monotonic()
+
+    def dispatch(self, request, matched: Tuple[str, str] = None):
+        """
+        处理静态资源请求
+        :param request:
+        :param matched: match_request 的结果，不指定时会重新查找
+        :return: 请求的不是静态文件时返回 None
+        """
+        if matched is None:
+            matched = self.match_request(request)
+            if matched is None:
+                return None
+
+        prefix, file_path = matched
+        info = self._stat(file_path)
+        if info is None:
+            return None
+
+        size, etag, mtime, content_type = info
+        headers = {
+            'ETag': '"%s"' % etag,
+            'Cache-Control': self.HASHED_CACHE_CONTROL
+            if self.HASHED_PATTERN.search(file_path) else 'public, max-age=%d' % self.max_age,
+        }
+
+        if not is_modified(request, etag, mtime):
+            return not_modified(headers=headers)
+
+        if prefix in self.memory_prefixes and size <= self.memory_file_size:
+            data = self._read(file_path, etag)
+            from werkzeug.http import http_date
+            headers['Last-Modified'] = http_date(mtime)
+            return FileResponse(data, content_type=content_type, request=request, headers=headers)
+
+        response = FileResponse(file_path, content_type=content_type, request=request, headers=headers)
+        if response.get_etag()[0] != etag:
+            # 文件在 stat 信息缓存期间发生了变化
+            self.stat_cache.remove(file_path)
+        return response
+
+    def _stat(self, file_path: str):
+        """
+        获取文件的 (大小，ETag，修改时间，内容类型)，文件不存在或者不是普通文件时返回 None
+        :param file_path:
+        :return:
+        """
+        now = time.monotonic()
+        cached = self.stat_cache.get(file_path)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        # noinspection PyBroadException
+        try:
+            file_stat = os.stat(file_path)
+        except Exception:
+            file_stat = None
+
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+            info = None
+        else:
+            content_type, _ = mimetypes.guess_type(file_path)
+            if content_type is None:
+                content_type = 'application/octet-stream'
+            elif content_type.startswith('text/') or content_type == 'application/javascript':
+                content_type += '; charset=utf-8'
+            # 与 FileResponse 生成的 ETag 一致
+            info = (file_stat.st_size, '%x-%x' % (file_stat.st_mtime_ns, file_stat.st_size),
+                    int(file_stat.st_mtime), content_type)
+
+        if self.stat_ttl:
+            self.stat_cache.set(file_path, (now + self.stat_ttl, info))
+        return info
+
+    def _read(self, file_path: str, etag: str) -> bytes:
+        cached = self.memory_cache.get(file_path)
+        if cached is not None and cached[0] == etag:
+            return cached[1]
+        with open(file_path, mode='rb') as fp:
+            data = fp.read()
+        self.memory_cache.set(file_path, (etag, data))
+        return data
@@ -0,0 +1,561 @@
+import itertools
+import os
+import queue
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler, select_address_family
+
+from .util import Logger
+
+
+class WorkerServer(ThreadedWSGIServer):
+    """
+    worker 进程中使用的线程化 WSGI 服务器，每个连接使用一个线程处理。
+    记录正在处理的请求数量，在停止监听后等待这些请求处理完成 (平滑停止)
+    """
+
+    multiprocess = True
+
+    def __init__(self, host: str, port: int, app, fd: int, handler=None):
+        """
+
+        :param host:
+        :param port:
+        :param app: WSGI 应用
+        :param fd: 监听的 socket 的文件描述符
+        :param handler: 请求处理器类
+        """
+        self._active = 0
+        self._idle = threading.Condition()
+        super().__init__(host, port, app, handler=handler, fd=fd)
+
+    def process_request(self, request, client_address):
+        with self._idle:
+            self._active += 1
+        try:
+            super().process_request(request, client_address)
+        except Exception as e:
+            self._finish_request()
+            raise e
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._finish_request()
+
+    def _finish_request(self):
+        with self._idle:
+            self._active -= 1
+            if self._active == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """
+        等待正在处理的请求处理完成
+        :param timeout: 超时时长，单位为秒
+        :return: 超时时返回 False
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._active == 0, timeout)
+
+    def stats(self) -> dict:
+        return {
+            'active': self._active,
+        }
+
+
+class PooledRequestHandler(WSGIRequestHandler):
+    # 线程池中的线程数量固定，不能被空闲的连接长期占用：
+    # 每个连接只处理一个请求 (不使用 HTTP/1.1 keep-alive)，
+    # 并且读取数据的等待超过 timeout 秒时断开连接
+    protocol_version = 'HTTP/1.0'
+    timeout = 30
+
+    def make_environ(self):
+        environ = super().make_environ()
+        # 请求在队列中等待的时长，单位为秒
+        environ['restfx.queue_time'] = getattr(self.server.local, 'queue_time', 0)
+        # 通过 environ['restfx.server'].stats() 可以获取服务器的统计信息
+        environ['restfx.server'] = self.server
+        return environ
+
+
+class PooledWorkerServer(WorkerServer):
+    """
+    使用固定数量的线程处理请求的 WSGI 服务器。
+
+    接受的连接先放入有上限的队列，再由线程池中的线程处理；
+    队列已满时，直接响应 503 (负载卸除)，以避免线程和内存无限增长，使延迟平缓地上升而不是进程崩溃。
+    请求在队列中等待的时长记录在 environ['restfx.queue_time'] 中，并汇总在 stats() 中
+    """
+
+    # 负载卸除时的响应
+    REJECT_RESPONSE = (b'HTTP/1.0 503 Service Unavailable\r\n'
+                       b'Content-Type: text/plain\r\n'
+                       b'Content-Length: 19\r\n'
+                       b'Retry-After: 1\r\n'
+                       b'Connection: close\r\n'
+                       b'\r\n'
+                       b'Service Unavailable')
+    # 用于计算队列等待时长百分位数的最近的样本数量
+    SAMPLE_SIZE = 1024
+
+    def __init__(self, host: str, port: int, app, fd: int, threads: int = 16, queue_size: int = 64):
+        """
+
+        :param host:
+        :param port:
+        :param app: WSGI 应用
+        :param fd: 监听的 socket 的文件描述符
+        :param threads: 处理请求的线程数量
+        :param queue_size: 等待处理的连接的最大数量，超过时响应 503
+        """
+        self.threads = threads
+        self.queue_size = queue_size
+        self.local = threading.local()
+        self._queue = queue.Queue(queue_size)
+        self._stats_lock = threading.Lock()
+        self._handled = 0
+        self._rejected = 0
+        self._queue_time_total = 0
+        self._queue_time_max = 0
+        self._queue_time_samples = deque(maxlen=self.SAMPLE_SIZE)
+        # 关闭后放入队列的线程结束标记的数量
+        self._stop_marks = 0
+
+        super().__init__(host, port, app, fd, handler=PooledRequestHandler)
+
+        self._workers = []
+        for index in range(threads):
+            thread = threading.Thread(target=self._work, name='restfx-worker-%d' % index, daemon=True)
+            thread.start()
+            self._workers.append(thread)
+
+    def process_request(self, request, client_address):
+        with self._idle:
+            self._active += 1
+        try:
+            self._queue.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            self._reject(request)
+            self.shutdown_request(request)
+            self._finish_request()
+
+    def _reject(self, request):
+        # noinspection PyBroadException
+        try:
+            request.settimeout(1)
+            request.sendall(self.REJECT_RESPONSE)
+            # 读取已经到达的请求数据，避免关闭时因为有未读取的数据而发送 RST，导致客户端收不到响应
+            request.setblocking(False)
+            request.recv(65536)
+        except Exception:
+            pass
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            request, client_address, queued_at = item
+            queue_time = time.monotonic() - queued_at
+            with self._stats_lock:
+                self._handled += 1
+                self._queue_time_total += queue_time
+                if queue_time > self._queue_time_max:
+                    self._queue_time_max = queue_time
+                self._queue_time_samples.append(queue_time)
+
+            self.local.queue_time = queue_time
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self._finish_request()
+
+    def server_close(self):
+        super().server_close()
+        # 已经在队列中的连接处理完成后，线程退出
+        self._stop_marks = len(self._workers)
+        for _ in self._workers:
+            self._queue.put(None)
+
+    def stats(self) -> dict:
+        """
+        获取服务器的统计信息，时长的单位为毫秒
+        :return:
+        """
+        with self._stats_lock:
+            samples = sorted(self._queue_time_samples)
+            handled = self._handled
+            rejected = self._rejected
+            queue_time_total = self._queue_time_total
+            queue_time_max = self._queue_time_max
+
+        def percentile(percent):
+            if not samples:
+                return 0
+            return samples[min(len(samples) - 1, int(len(samples) * percent / 100))] * 1000
+
+        return {
+            'threads': self.threads,
+            'queue_size': self.queue_size,
+            'active': self._active,
+            'queued': max(0, self._queue.qsize() - self._stop_marks),
+            'handled': handled,
+            'rejected': rejected,
+            'queue_time_avg': queue_time_total / handled * 1000 if handled else 0,
+            'queue_time_p50': percentile(50),
+            'queue_time_p99': percentile(99),
+            'queue_time_max': queue_time_max * 1000,
+        }
+
+
+class PreforkServer:
+    """
+    多进程 (pre-fork) 服务器，用于生产环境，通过 App.serve 或者 restfx serve 命令启动 (需要支持 os.fork 的系统)
+
+    - 主进程导入应用并预热路由后再 fork 出 worker 进程，worker 进程以写时复制的方式共享已加载的模块
+    - 每个 worker 进程通过固定数量的线程处理请求 (PooledWorkerServer)，等待处理的连接过多时响应 503
+    - worker 处理的请求数量达到 max_requests 后会平滑退出，并由主进程重新创建
+    - worker 异常退出时，主进程会重新创建
+
+    主进程响应的信号:
+
+    - TERM, INT: 平滑停止，等待 worker 处理完正在处理的请求
+    - QUIT: 立即停止
+    - HUP: 平滑重启，创建新的 worker 后平滑停止旧的 worker
+    - TTIN, TTOU: 增加/减少一个 worker
+    """
+
+    # 主进程处理的信号
+    SIGNALS = ('SIGTERM', 'SIGINT', 'SIGQUIT', 'SIGHUP', 'SIGTTIN', 'SIGTTOU', 'SIGCHLD')
+
+    def __init__(self, app, host: str = None, port: int = 9127, workers: int = None, threads: int = 16,
+                 queue_size: int = 64, max_requests: int = 0, max_requests_jitter: int = 0, reuse_port: bool = False,
+                 graceful_timeout: float = 30, backlog: int = 2048, stats_interval: float = 0):
+        """
+
+        :param app: App 实例
+        :param host: 监听的地址，不指定时为 127.0.0.1
+        :param port: 监听的端口
+        :param workers: worker 进程数量，不指定时为 cpu 数量
+        :param threads: 每个 worker 进程中处理请求的线程数量，为 0 时每个连接使用一个新的线程 (不限制线程数量)
+        :param queue_size: 每个 worker 进程中等待处理的连接的最大数量，超过时响应 503
+        :param max_requests: 每个 worker 最多处理的请求数量，达到后 worker 会被重新创建，为 0 时不限制
+        :param max_requests_jitter: 给每个 worker 的 max_requests 增加 [0, max_requests_jitter] 的随机值，
+        以避免所有 worker 同时重新创建
+        :param reuse_port: 是否使用 SO_REUSEPORT，启用时每个 worker 单独监听端口，由内核分配连接，
+        否则所有 worker 共享主进程监听的 socket
+        :param graceful_timeout: 平滑停止时等待请求处理完成的最大时长，单位为秒，超时后强制停止
+        :param backlog: 监听队列的长度
+        :param stats_interval: 输出 worker 统计信息 (请求数量、队列等待时长等) 的间隔，单位为秒，为 0 时不输出
+        """
+        if host in [None, '', '*']:
+            host = '127.0.0.1'
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError('SO_REUSEPORT is not supported on %s' % sys.platform)
+
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.queue_size = queue_size
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.stats_interval = stats_interval
+        self.logger = Logger.current()
+
+        self.socket = None
+        # worker 进程，其键为 pid，值为 worker 所属的代 (每次平滑重启时增加)
+        self._workers = {}
+        self._generation = 0
+        # 正在停止的 worker，其键为 pid，值为强制停止的时间
+        self._stopping = {}
+        # 最近一次 worker 异常退出的时间，用于避免 worker 启动失败时不断地重新创建
+        self._failed_at = 0
+        # 收到的信号以及用于唤醒主循环的管道
+        self._signals = []
+        self._pipe = None
+
+    def warmup(self):
+        """
+        在 fork 前预热应用: 编译路由表并加载所有路由函数所在的模块
+        :return:
+        """
+        router = self.app.router
+        if not router.route_table.compiled:
+            router.compile_routes()
+
+        if router.route_table.routes:
+            count = self.app.warmup()
+            self.logger.info('%d lazy route(s) loaded' % count)
+        elif not self.app.config.debug:
+            # 未注册路由时 (scan_routes)，路由函数在请求时解析，此处只提前导入其所在的模块
+            from .routes.collector import Collector
+            routes = Collector.get(self.app.id).collect(self.app.config.routes_map)
+            self.logger.info('%d route(s) imported' % len(routes))
+
+    def _create_socket(self) -> socket.socket:
+        family = select_address_family(self.host, self.port)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((self.host, self.port))
+        except Exception as e:
+            sock.close()
+            raise e
+        return sock
+
+    def run(self):
+        """
+        启动服务器，在收到停止信号后返回
+        :return:
+        """
+        if not hasattr(os, 'fork'):
+            raise RuntimeError('PreforkServer requires os.fork, which is not available on %s' % sys.platform)
+
+        self.warmup()
+
+        # 使用 SO_REUSEPORT 时，主进程持有绑定了端口但不监听的 socket，以占用端口，连接只会分配给 worker
+        self.socket = self._create_socket()
+        if not self.reuse_port:
+            self.socket.listen(self.backlog)
+        self.port = self.socket.getsockname()[1]
+
+        self._pipe = os.pipe()
+        for fd in self._pipe:
+            os.set_blocking(fd, False)
+        handlers = {}
+        for name in self.SIGNALS:
+            signum = getattr(signal, name)
+            handlers[signum] = signal.signal(signum, self._on_signal)
+
+        self.logger.info('Serving at http://%s:%s with %d worker(s), master pid %d' % (
+            self.host, self.port, self.workers, os.getpid()))
+        try:
+            self._manage_workers()
+            self._loop()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            for fd in self._pipe:
+                os.close(fd)
+            self._pipe = None
+            self.socket.close()
+            self.socket = None
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+        try:
+            os.write(self._pipe[1], b'.')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _loop(self):
+        while True:
+            try:
+                select.select([self._pipe[0]], [], [], 1)
+                os.read(self._pipe[0], 64)
+            except (BlockingIOError, InterruptedError):
+                pass
+
+            self._reap_workers()
+
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.logger.info('Stopping gracefully')
+                    self.stop(True)
+                    return
+                if signum == signal.SIGQUIT:
+                    self.logger.info('Stopping')
+                    self.stop(False)
+                    return
+                if signum == signal.SIGHUP:
+                    self.logger.info('Reloading workers')
+                    self.reload()
+                elif signum == signal.SIGTTIN:
+                    self.workers += 1
+                elif signum == signal.SIGTTOU:
+                    self.workers = max(1, self.workers - 1)
+
+            self._manage_workers()
+            self._kill_overdue()
+
+    def _reap_workers(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            generation = self._workers.pop(pid, None)
+            stopping = self._stopping.pop(pid, None) is not None
+            if generation is None:
+                continue
+            code = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+            if code != 0 and not stopping:
+                self.logger.warning('Worker %d exited unexpectedly with code %s' % (pid, code))
+                self._failed_at = time.monotonic()
+
+    def _manage_workers(self):
+        if time.monotonic() - self._failed_at < 1:
+            return
+        current = [pid for pid, generation in self._workers.items()
+                   if generation == self._generation and pid not in self._stopping]
+        for _ in range(self.workers - len(current)):
+            self._spawn_worker()
+        # worker 数量减少时，停止最早创建的 worker
+        for pid in current[:max(0, len(current) - self.workers)]:
+            self._stop_worker(pid, True)
+
+    def _stop_worker(self, pid: int, graceful: bool):
+        try:
+            os.kill(pid, signal.SIGTERM if graceful else signal.SIGQUIT)
+        except ProcessLookupError:
+            return
+        self._stopping[pid] = time.monotonic() + (self.graceful_timeout if graceful else 1)
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self._stopping.items()):
+            if deadline > now:
+                continue
+            self.logger.warning('Killing worker %d' % pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            # 避免重复发送
+            self._stopping[pid] = float('inf')
+
+    def reload(self):
+        """
+        平滑重启: 创建新一代的 worker，然后平滑停止旧的 worker
+        :return:
+        """
+        old_workers = [pid for pid in self._workers if pid not in self._stopping]
+        self._generation += 1
+        self._manage_workers()
+        for pid in old_workers:
+            self._stop_worker(pid, True)
+
+    def stop(self, graceful: bool = True):
+        """
+        停止所有 worker，并等待其退出
+        :param graceful: 是否等待 worker 处理完正在处理的请求
+        :return:
+        """
+        for pid in list(self._workers):
+            if pid not in self._stopping or not graceful:
+                self._stop_worker(pid, graceful)
+
+        while self._workers:
+            self._reap_workers()
+            self._kill_overdue()
+            time.sleep(0.1)
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self._workers[pid] = self._generation
+            return
+
+        code = 0
+        try:
+            self._run_worker()
+        except BaseException as e:
+            code = 1
+            self.logger.error('Worker %d failed' % os.getpid(), e)
+        finally:
+            # 不执行 atexit 等清理过程，这些过程由主进程执行
+            os._exit(code)
+
+    def _run_worker(self):
+        for name in self.SIGNALS:
+            signal.signal(getattr(signal, name), signal.SIG_DFL)
+        for fd in self._pipe:
+            os.close(fd)
+
+        if self.reuse_port:
+            listener = self._create_socket()
+            listener.listen(self.backlog)
+        else:
+            listener = self.socket
+
+        stopping = threading.Event()
+        server = None
+
+        def stop(*args):
+            if stopping.is_set():
+                return
+            stopping.set()
+            # shutdown 需要在 serve_forever 以外的线程中调用
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        app = self.app
+        if self.max_requests:
+            limit = self.max_requests + random.randint(0, self.max_requests_jitter)
+            counter = itertools.count(1)
+
+            def app(environ, start_response):
+                if next(counter) == limit:
+                    self.logger.info('Worker %d reached max requests %d, restarting' % (os.getpid(), limit))
+                    stop()
+                return self.app(environ, start_response)
+
+        if self.threads:
+            server = PooledWorkerServer(self.host, self.port, app, listener.fileno(), self.threads, self.queue_size)
+        else:
+            server = WorkerServer(self.host, self.port, app, listener.fileno())
+        # 服务器使用的是复制的文件描述符
+        listener.close()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGQUIT, lambda *args: os._exit(0))
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTTIN, signal.SIG_IGN)
+        signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+
+        if self.stats_interval:
+            def report():
+                while not stopping.wait(self.stats_interval):
+                    self.logger.info('Worker %d: %s' % (os.getpid(), self._format_stats(server.stats())))
+
+            threading.Thread(target=report, name='restfx-stats', daemon=True).start()
+
+        self.logger.debug('Worker %d started' % os.getpid())
+        server.serve_forever()
+        if not server.wait_idle(self.graceful_timeout):
+            self.logger.warning('Worker %d stopped with unfinished requests' % os.getpid())
+        self.logger.debug('Worker %d stopped: %s' % (os.getpid(), self._format_stats(server.stats())))
+
+    @staticmethod
+    def _format_stats(stats: dict) -> str:
+        return ', '.join(
+            '%s=%.2f' % (key, value) if isinstance(value, float) else '%s=%s' % (key, value)
+            for key, value in stats.items()
+        )
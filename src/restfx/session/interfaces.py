@@ -1,4 +1,6 @@
+import os
 import time
+import weakref
 from abc import ABC, abstractmethod
 from threading import Timer
 from types import FunctionType
@@ -31,9 +33,22 @@ class ISessionProvider(ABC):
 
         if check_interval:
             self.timer = self.run_timer()
+            # 定时器线程不会被 fork 复制到子进程中 (如预派生服务器的工作进程)，需要在子进程中重新启动
+            # 使用弱引用，避免注册的回调使 provider 无法被回收
+            if hasattr(os, 'register_at_fork'):
+                ref = weakref.ref(self)
+                os.register_at_fork(after_in_child=lambda: ISessionProvider._restart_timer(ref))
         else:
             self.timer = None
 
+    @staticmethod
+    def _restart_timer(ref):
+        provider = ref()
+        # 已经回收 (dispose) 或没有启动定时器的 provider 不需要重新启动
+        if provider is None or provider.timer is None:
+            return
+        provider.timer = provider.run_timer()
+
     def run_timer(self):
         # 不会过期，不用启动定时器
         if self.expired <= 0 or self.check_interval <= 0:
@@ -146,6 +161,7 @@ class ISessionProvider(ABC):
         if self.timer and self.timer.is_alive():
             self.timer.cancel()
             self.timer.join()
+        self.timer = None
         if self.auto_clear:
             self.clear()
 
@@ -1,5 +1,7 @@
+import heapq
 import os
 import tempfile
+import threading
 from contextlib import contextmanager
 from types import FunctionType
 from typing import List, Optional, Tuple
@@ -10,42 +12,165 @@ from .session import HttpSession
 
 class MemorySessionProvider(ISessionProvider):
     """
-    基于内存的 session 管理
-    注：此类型仅适用于单线程开发环境, 多线程时会出现无法预料的问题；请勿用于生产环境！
+    基于内存的 session 管理，可以在多线程环境中使用 (多进程时每个进程的 session 相互独立)
+
+    - session 按 id 分片存储，写入时使用分片的锁，读取时不加锁
+    - 维护按终端地址 (remote_addr) 的索引，get_by_remote_addr 不需要遍历所有 session
+    - 使用最小堆记录 session 的访问时间，检查过期时只需要处理堆顶已经到期的项 (仅在启用了过期检查时记录)
     """
 
-    def __init__(self, expired: int = None, check_interval=0, on_expired: FunctionType = None):
+    def __init__(self, expired: int = None, check_interval=0, on_expired: FunctionType = None, shards: int = 16):
+        """
+
+        :param expired:
+        :param check_interval:
+        :param on_expired:
+        :param shards: 分片数量
+        """
+        # 分片，其项为 ({session_id: (session, 索引的 remote_addr)}, 锁)
+        self.shards = [({}, threading.Lock()) for _ in range(shards)]
+        # 终端地址索引，其键为 remote_addr，值为 {session_id: session}
+        self.addr_index = {}
+        self.addr_lock = threading.Lock()
+        # 过期堆，其项为 (最后访问时间, session_id)。
+        # 最后访问时间在 session 被访问时会直接更新 (不会通知 provider)，因此检查过期时以 session 中的时间为准
+        self.expire_heap = []
+        # 过期堆中已经被移除的 session 的项的数量，超过有效项的数量时清理过期堆
+        self.expire_stale = 0
+        self.expire_lock = threading.Lock()
         super().__init__(expired, check_interval, True, on_expired)
-        self.sessions = {}
+
+    @property
+    def sessions(self) -> dict:
+        """
+        所有 session 的快照
+        :return:
+        """
+        sessions = {}
+        for shard, lock in self.shards:
+            with lock:
+                for session_id, (session, _) in shard.items():
+                    sessions[session_id] = session
+        return sessions
+
+    def _track_expire(self) -> bool:
+        # 不检查过期时，不需要维护过期堆
+        return self.expired > 0 and self.check_interval > 0
+
+    def _compact_expire_heap(self):
+        # 需要在 expire_lock 中调用，移除已经不存在的 session 的项
+        heap = []
+        seen = set()
+        for item in self.expire_heap:
+            session_id = item[1]
+            if session_id in seen or not self.exists(session_id):
+                continue
+            seen.add(session_id)
+            heap.append(item)
+        heapq.heapify(heap)
+        self.expire_heap = heap
+        self.expire_stale = 0
+
+    def _get_shard(self, session_id: str):
+        return self.shards[hash(session_id) % len(self.shards)]
+
+    def _index(self, session: HttpSession, addr: str, old_addr: Optional[str]):
+        """
+        更新终端地址索引
+        :param session:
+        :param addr: session 的地址
+        :param old_addr: session 原来索引的地址，为 None 表示 session 原来不存在
+        :return:
+        """
+        with self.addr_lock:
+            if old_addr is not None:
+                self._unindex(session.id, old_addr)
+            self.addr_index.setdefault(addr, {})[session.id] = session
+
+    def _unindex(self, session_id: str, addr: str):
+        # 需要在 addr_lock 中调用
+        sessions = self.addr_index.get(addr)
+        if sessions is not None:
+            sessions.pop(session_id, None)
+            if not sessions:
+                del self.addr_index[addr]
 
     def get_by_remote_addr(self, addr: str) -> List[HttpSession]:
-        return [
-            session
-            for session in self.sessions.values() if session.remote_addr == addr
-        ]
+        sessions = self.addr_index.get(addr)
+        if not sessions:
+            return []
+        with self.addr_lock:
+            return list(sessions.values())
 
     def remove(self, session_id: str):
-        if self.exists(session_id):
-            del self.sessions[session_id]
+        shard, lock = self._get_shard(session_id)
+        with lock:
+            stored = shard.pop(session_id, None)
+            if stored is not None:
+                with self.addr_lock:
+                    self._unindex(session_id, stored[1])
+
+        if stored is None or not self.expire_heap:
+            return
+        with self.expire_lock:
+            self.expire_stale += 1
+            if self.expire_stale * 2 > len(self.expire_heap):
+                self._compact_expire_heap()
 
     def clear(self):
-        self.sessions.clear()
+        for shard, lock in self.shards:
+            with lock:
+                shard.clear()
+        with self.addr_lock:
+            self.addr_index.clear()
+        with self.expire_lock:
+            self.expire_heap.clear()
+            self.expire_stale = 0
 
     def get_expired_session(self, time_before: float) -> List[str]:
-        expired_sessions = []
-        for session in self.sessions.values():
-            if time_before > session.last_access_time:
-                expired_sessions.append(session.id)
-        return expired_sessions
+        expired_sessions = {}
+        with self.expire_lock:
+            heap = self.expire_heap
+            checked = []
+            while heap and heap[0][0] < time_before:
+                _, session_id = heapq.heappop(heap)
+                session = self.get(session_id)
+                # 已经被移除
+                if session is None:
+                    if self.expire_stale > 0:
+                        self.expire_stale -= 1
+                    continue
+                # 按最新的访问时间重新入堆 (包括过期的 session，它们被移除后会在下一次检查时丢弃)
+                checked.append((session.last_access_time, session_id))
+                if session.last_access_time < time_before:
+                    expired_sessions[session_id] = None
+            for item in checked:
+                heapq.heappush(heap, item)
+        return list(expired_sessions)
 
     def get(self, session_id: str) -> Optional[HttpSession]:
-        return self.sessions[session_id] if self.exists(session_id) else None
+        shard, _ = self._get_shard(session_id)
+        stored = shard.get(session_id)
+        return None if stored is None else stored[0]
 
     def set(self, session: HttpSession):
-        self.sessions[session.id] = session
+        shard, lock = self._get_shard(session.id)
+        with lock:
+            stored = shard.get(session.id)
+            addr = session.remote_addr
+            shard[session.id] = (session, addr)
+            if stored is None:
+                self._index(session, addr, None)
+            elif stored[0] is not session or stored[1] != addr:
+                self._index(session, addr, stored[1])
+
+        if stored is None and self._track_expire():
+            with self.expire_lock:
+                heapq.heappush(self.expire_heap, (session.last_access_time, session.id))
 
     def exists(self, session_id: str):
-        return session_id in self.sessions
+        shard, _ = self._get_shard(session_id)
+        return session_id in shard
 
 
 class FileSessionProvider(ISessionProvider):
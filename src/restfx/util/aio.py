@@ -0,0 +1,155 @@
+"""
+请求处理流程的执行器
+
+请求处理流程 (中间件勾子、路由函数调用等) 被编写为生成器，每一个需要调用的函数都以步骤的形式 yield 出来:
+
+    result = yield func, args
+    result = yield func, args, True  # 第三项为 True 表示这是一个可能阻塞的调用 (如同步的路由函数)
+
+执行器负责调用这些函数，并将结果 (或者异常) 传回生成器。
+这样同一套流程既可以在 WSGI 下同步执行 (run_steps)，也可以在 ASGI 下异步执行 (run_steps_async)
+
+在 WSGI 下，async def 函数返回的协程会被提交到进程内共享的后台事件循环中执行 (run_sync)，
+当前线程等待其执行完成
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from inspect import isawaitable, iscoroutinefunction, unwrap
+from typing import Awaitable, Callable, Generator
+
+# 后台事件循环，每个进程一个，在首次使用时创建
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def run_steps(steps: Generator):
+    """
+    同步执行请求处理流程
+    :param steps:
+    :return: 流程的返回值
+    """
+    value = None
+    error = None
+    while True:
+        try:
+            if error is None:
+                step = steps.send(value)
+            else:
+                step = steps.throw(error)
+        except StopIteration as e:
+            return e.value
+
+        error = None
+        try:
+            value = step[0](*step[1])
+            if isawaitable(value):
+                value = run_sync(value)
+        except Exception as e:
+            value = None
+            error = e
+
+
+async def run_steps_async(steps: Generator, run_blocking: Callable[..., Awaitable]):
+    """
+    异步执行请求处理流程
+    :param steps:
+    :param run_blocking: 用于执行阻塞调用的函数，其接收的参数为 (func, *args)，返回 Awaitable
+    :return: 流程的返回值
+    """
+    value = None
+    error = None
+    while True:
+        try:
+            if error is None:
+                step = steps.send(value)
+            else:
+                step = steps.throw(error)
+        except StopIteration as e:
+            return e.value
+
+        error = None
+        try:
+            if len(step) > 2 and step[2]:
+                value = await run_blocking(step[0], *step[1])
+            else:
+                value = step[0](*step[1])
+            if isawaitable(value):
+                value = await value
+        except Exception as e:
+            value = None
+            error = e
+
+
+def is_async_callable(func) -> bool:
+    """
+    判断函数是否为 async def 函数 (包括使用 functools.wraps 装饰后的函数)
+    :param func:
+    :return:
+    """
+    func = unwrap(func)
+    if iscoroutinefunction(func):
+        return True
+    # 绑定方法、实现了 async def __call__ 的对象
+    func = getattr(func, '__func__', None) or getattr(func, '__call__', None)
+    return func is not None and iscoroutinefunction(func)
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    获取当前进程的后台事件循环，其运行在一个守护线程中
+    :return:
+    """
+    global _loop
+    loop = _loop
+    if loop is not None:
+        return loop
+
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='restfx-aio', daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def _reset_after_fork():
+    # fork 出的子进程中没有父进程的后台线程，需要重新创建事件循环
+    global _loop, _loop_lock
+    _loop = None
+    _loop_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+async def _await_in_context(awaitable, context: contextvars.Context):
+    # 在事件循环的任务中还原调用方的上下文，使 HttpRequest.current() 等可用
+    for var, value in context.items():
+        var.set(value)
+    return await awaitable
+
+
+def run_sync(awaitable):
+    """
+    在后台事件循环中执行 awaitable，并阻塞当前线程直到其执行完成
+    :param awaitable:
+    :return: awaitable 的结果
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        close = getattr(awaitable, 'close', None)
+        if close is not None:
+            # 避免出现 "coroutine was never awaited" 警告
+            close()
+        raise RuntimeError('Cannot wait for %r synchronously inside a running event loop, '
+                           'use "App.asgi" as the application' % awaitable)
+
+    coroutine = _await_in_context(awaitable, contextvars.copy_context())
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
@@ -6,6 +6,7 @@ from enum import Enum
 from types import FunctionType
 
 from ..session import HttpSession
+from .aio import is_async_callable
 from .utils import get_func_info
 from ..http import HttpRequest
 
@@ -144,6 +145,8 @@ class FunctionDescription:
 
     def __init__(self, func: FunctionType):
         self.func = func
+        # 是否为 async def 函数，在 WSGI 下会在后台事件循环中执行
+        self.is_async = is_async_callable(func)
         self.description = ''
         self.return_description = ''
         self.return_type = ''
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# a singleton sentinel value for parameter defaults
+_sentinel = object()
+
+
+class LRUCache:
+    """
+    有容量上限的 LRU 缓存，支持过期时间，线程安全
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 0):
+        """
+
+        :param maxsize: 最大缓存项数量，超出时移除最久未使用的项
+        :param ttl: 缓存项的有效时长，单位为秒，指定为 0 表示不会过期
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _sentinel)
+            if item is _sentinel:
+                self.misses += 1
+                return default
+
+            value, expires = item
+            if expires and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def remove(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """
+        缓存的统计信息
+        :return:
+        """
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
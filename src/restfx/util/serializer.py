@@ -0,0 +1,151 @@
+import json
+from typing import Callable, Optional, Union
+
+
+def _import_backend(name: str):
+    if name == 'json':
+        return json
+    # noinspection PyBroadException
+    try:
+        import importlib
+        return importlib.import_module(name)
+    except Exception:
+        return None
+
+
+class JsonSerializer:
+    """
+    JSON 序列化器，直接从 bytes 解码，以及编码为 bytes
+
+    - 默认使用标准库 json，可以通过 use (App.set_json_backend) 切换为 orjson 或 ujson (需要另行安装)。
+      这些后端与标准库的行为存在差异: 例如 orjson 会将 datetime 序列化为 ISO 格式，超出 64 位的整数会被解析为浮点数
+    - 可以通过 register_type 注册自定义类型的序列化函数
+    - 可以指定 json.JSONEncoder 的子类 (例如 FunctionDescription.JSONEncoder) 来序列化自定义类型，此时总是使用标准库
+    - 后端无法处理的数据会交给标准库处理
+    """
+
+    # 自动选择时，使用的后端顺序
+    BACKENDS = ('orjson', 'ujson', 'json')
+
+    def __init__(self, backend: str = 'json'):
+        """
+
+        :param backend: 使用的后端，可选值为 orjson, ujson, json，为 None 时自动选择第一个可用的后端
+        """
+        self.name = None
+        self.backend = None
+        self.types = {}
+        """
+        自定义类型的序列化函数集合，其键为类型，值为将该类型转换为可序列化对象的函数
+        :type: Dict[type, Callable]
+        """
+        self.use(backend)
+
+    def use(self, backend: str = None):
+        """
+        切换使用的后端
+        :param backend: 使用的后端，可选值为 orjson, ujson, json，为 None 时自动选择第一个可用的后端
+        :return:
+        """
+        if backend is not None:
+            if backend not in self.BACKENDS:
+                raise ValueError('Unsupported json backend "%s", available: %s' % (backend, ', '.join(self.BACKENDS)))
+            module = _import_backend(backend)
+            if module is None:
+                raise ImportError('The json backend "%s" is not installed' % backend)
+            self.name = backend
+            self.backend = module
+            return
+
+        for name in self.BACKENDS:
+            module = _import_backend(name)
+            if module is not None:
+                self.name = name
+                self.backend = module
+                return
+
+    def register_type(self, type_: type, handler: Callable):
+        """
+        注册自定义类型的序列化函数
+        :param type_: 自定义类型
+        :param handler: 将该类型的对象转换为可序列化对象的函数，其接收一个参数：要序列化的对象
+        :return:
+        """
+        self.types[type_] = handler
+
+    def loads(self, data: Union[bytes, str]):
+        """
+        反序列化，bytes 不会被解码成 str 后再处理
+        :param data:
+        :return:
+        """
+        if self.name != 'json':
+            try:
+                return self.backend.loads(data)
+            except ValueError:
+                # 后端不支持的数据交给标准库处理，数据确实无效时由标准库抛出异常
+                pass
+        # 标准库会自动检测 bytes 的编码
+        return json.loads(data)
+
+    def dumps(self, obj, encoder: type = None, ensure_ascii: Optional[bool] = None) -> bytes:
+        """
+        序列化为 utf-8 编码的 bytes
+        :param obj:
+        :param encoder: json.JSONEncoder 的子类，用于序列化自定义类型，指定时总是使用标准库
+        :param ensure_ascii: 是否将非 ASCII 字符转义，为 None 时由后端决定 (标准库会转义，orjson 和 ujson 不会转义)
+        :return:
+        """
+        default = self._get_default(encoder)
+
+        # 指定了 encoder 时使用标准库，后端会直接处理其支持的类型 (如 datetime)，而不调用 encoder.default
+        if encoder is not None:
+            pass
+        elif self.name == 'orjson' and not ensure_ascii:
+            try:
+                return self.backend.dumps(obj, default=default, option=self.backend.OPT_NON_STR_KEYS)
+            except TypeError:
+                # orjson 不支持的数据 (例如超出 64 位的整数) 交给标准库处理
+                pass
+        elif self.name == 'ujson':
+            try:
+                return self.backend.dumps(
+                    obj, default=default, ensure_ascii=bool(ensure_ascii)
+                ).encode()
+            except TypeError:
+                pass
+
+        return json.dumps(obj, cls=encoder, default=default, ensure_ascii=ensure_ascii is not False).encode()
+
+    def _get_default(self, encoder: type = None):
+        types = self.types
+        encoder_default = encoder().default if encoder is not None else None
+
+        if not types:
+            return encoder_default
+
+        def default(o):
+            for type_, handler in types.items():
+                if isinstance(o, type_):
+                    return handler(o)
+            if encoder_default is not None:
+                return encoder_default(o)
+            raise TypeError('Object of type %s is not JSON serializable' % type(o).__name__)
+
+        return default
+
+
+_default_serializer = JsonSerializer()
+
+
+def current() -> JsonSerializer:
+    """
+    获取当前应用使用的序列化器，在应用上下文之外时，返回默认的序列化器
+    :return:
+    """
+    from .. import globs
+    # noinspection PyProtectedMember
+    top = globs._app_ctx_stack.top
+    if top is None:
+        return _default_serializer
+    return top.app.config.serializer